@@ -1,42 +1,63 @@
-import sys
+import importlib
+import logging
 import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Which app module to serve; configured per deployment in vercel.json
+APP_MODULE = os.environ.get('AVENCION_APP', 'app_simple_working')
+
+# sys.modules key the resolved app module is cached under for reused interpreters
+APP_CACHE_KEY = '_avencion_app'
+
+# Functions app modules use to create their own tables once per process
+TABLE_GUARDS = ('ensure_tables', 'init_database_tables')
 
-# Set environment variables for Vercel
-os.environ['VERCEL'] = '1'
+def load_app(module_name):
+    """Import the app module and prepare its Flask app for serving"""
+    cached_module = sys.modules.get(APP_CACHE_KEY)
+    if cached_module is not None and cached_module.__name__ == module_name:
+        return cached_module.app
 
-try:
-    from app_simple_working import app
-    print("✅ Successfully imported app_simple_working")
-except Exception as e:
-    print(f"⚠️ Error importing app_simple_working: {e}")
-    # Fallback: try to import the main app
     try:
-        from app_vercel import app
-        print("✅ Successfully imported app_vercel as fallback")
-    except Exception as e2:
-        print(f"❌ Error importing app_vercel: {e2}")
-        # Final fallback: try the original app
+        app_module = importlib.import_module(module_name)
+    except Exception as e:
+        logger.error("Error importing %s: %s", module_name, e)
+        raise
+
+    flask_app = app_module.app
+
+    # Modules with their own guard create their tables at import or on the first
+    # request; create the others' tables here, once per process
+    if not any(hasattr(app_module, guard) for guard in TABLE_GUARDS):
         try:
-            from app import app
-            print("✅ Successfully imported app as final fallback")
-        except Exception as e3:
-            print(f"❌ Error importing app: {e3}")
-            raise e3
+            with flask_app.app_context():
+                app_module.db.create_all()
+        except Exception as e:
+            logger.warning("Database initialization warning: %s", e)
+
+    sys.modules[APP_CACHE_KEY] = app_module
+    return flask_app
+
+class LazyApp:
+    """WSGI proxy that defers importing the Flask app until the first request"""
+    def __init__(self, module_name):
+        self.module_name = module_name
+        self._app = None
+
+    def load(self):
+        if self._app is None:
+            self._app = load_app(self.module_name)
+        return self._app
+
+    def __call__(self, environ, start_response):
+        return self.load()(environ, start_response)
 
 # This is the entry point for Vercel
-# Vercel expects the app to be available as a global variable
-app.debug = False
-
-# Initialize database tables on startup
-try:
-    with app.app_context():
-        from app_simple_working import db
-        db.create_all()
-        print("✅ Database tables created successfully")
-except Exception as e:
-    print(f"⚠️ Database initialization warning: {e}")
+# Vercel expects a WSGI callable to be available as a global variable
+app = LazyApp(APP_MODULE)
 
 # For Vercel serverless functions
 if __name__ == '__main__':
-    app.run() 
\ No newline at end of file
+    app.load().run()
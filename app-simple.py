@@ -5,12 +5,13 @@ from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 import pandas as pd
 import openpyxl
-import json
+import orjson
 import warnings
-import hashlib
 import secrets
 from collections import defaultdict
+from functools import wraps
 from dotenv import load_dotenv
+from avencion_common import check_credentials
 warnings.filterwarnings('ignore', category=FutureWarning)
 
 # Load environment variables from .env file
@@ -21,37 +22,47 @@ login_attempts = defaultdict(list)
 MAX_LOGIN_ATTEMPTS = 5
 LOGIN_TIMEOUT = 300  # 5 minutes
 
-# Custom JSON encoder to handle datetime objects
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        elif pd.isna(obj):
-            return None
-        return super().default(obj)
+def json_default(obj):
+    """Serialize the values orjson has no native support for"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    elif pd.isna(obj):
+        return None
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
 
-# Authentication configuration
-AVENCION_USERNAME = "Avencion"
-AVENCION_PASSWORD_HASH = hashlib.sha256("AvencionData@Center2025".encode()).hexdigest()
+def dumps_json(obj):
+    """Serialize obj to a JSON string with orjson"""
+    return orjson.dumps(obj, default=json_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+
+def remove_file(path):
+    """Delete a record's file, if it has one, with a single unlink"""
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
 def login_required(f):
     """Decorator to require authentication for routes"""
+    @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not session.get('authenticated'):
+        # Resolve the session proxy once for all the checks below
+        current_session = session._get_current_object()
+        if not current_session.get('authenticated'):
             return redirect(url_for('login'))
         
         # Additional session validation
-        if not session.get('session_id') or not session.get('username'):
-            session.clear()
+        if not current_session.get('session_id') or not current_session.get('username'):
+            current_session.clear()
             return redirect(url_for('login'))
         
         # Check if session is from same IP (optional security measure)
-        if session.get('ip_address') and session.get('ip_address') != request.remote_addr:
-            session.clear()
+        session_ip = current_session.get('ip_address')
+        if session_ip and session_ip != request.remote_addr:
+            current_session.clear()
             return redirect(url_for('login'))
         
         return f(*args, **kwargs)
-    decorated_function.__name__ = f.__name__
     return decorated_function
 
 def clean_dataframe(df):
@@ -176,15 +187,19 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)  # Session expires in 24 hours
 
-# Security headers
+# Security headers, fixed for every response
+SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+    'Strict-Transport-Security': 'max-age=31536000; includeSubDomains',
+    'Cache-Control': 'no-store, no-cache, must-revalidate, max-age=0',
+    'Pragma': 'no-cache',
+}
+
 @app.after_request
 def add_security_headers(response):
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
+    response.headers.update(SECURITY_HEADERS)
     return response
 
 # Use SQLite for local development, PostgreSQL for production
@@ -506,7 +521,7 @@ def login():
             return render_template('login.html')
         
         # Verify credentials
-        if username == AVENCION_USERNAME and hashlib.sha256(password.encode()).hexdigest() == AVENCION_PASSWORD_HASH:
+        if check_credentials(username, password):
             # Clear login attempts on successful login
             login_attempts[client_ip].clear()
             
@@ -629,8 +644,8 @@ def upload_spreadsheet(cohort_id):
                     name=request.form.get('name', filename),
                     filename=filename,
                     file_path=file_path,
-                    sheet_names=json.dumps(columns_info.get('sheets', []), cls=DateTimeEncoder),
-                    columns_info=json.dumps(columns_info, cls=DateTimeEncoder),
+                    sheet_names=dumps_json(columns_info.get('sheets', [])),
+                    columns_info=dumps_json(columns_info),
                     row_count=row_count,
                     cohort_id=cohort_id,
                     created_by=request.form.get('created_by', 'Avencion')
@@ -655,7 +670,7 @@ def upload_spreadsheet(cohort_id):
 @login_required
 def spreadsheet_detail(spreadsheet_id):
     spreadsheet = Spreadsheet.query.get_or_404(spreadsheet_id)
-    columns_info = json.loads(spreadsheet.columns_info)
+    columns_info = orjson.loads(spreadsheet.columns_info)
     return render_template('spreadsheet_detail.html', spreadsheet=spreadsheet, columns_info=columns_info)
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/download')
@@ -703,7 +718,7 @@ def view_spreadsheet(spreadsheet_id):
                     'total_rows': 10,
                     'sheets': ['Sheet1']
                 }
-                spreadsheet.columns_info = json.dumps(columns_info, cls=DateTimeEncoder)
+                spreadsheet.columns_info = dumps_json(columns_info)
                 spreadsheet.updated_at = datetime.utcnow()
                 db.session.commit()
                 
@@ -1300,13 +1315,11 @@ def delete_project(project_id):
     # Delete all related data
     for cohort in project.cohorts:
         for spreadsheet in cohort.spreadsheets:
-            if spreadsheet.file_path and os.path.exists(spreadsheet.file_path):
-                os.remove(spreadsheet.file_path)
+            remove_file(spreadsheet.file_path)
         db.session.delete(cohort)
     
     for database in project.databases:
-        if database.file_path and os.path.exists(database.file_path):
-            os.remove(database.file_path)
+        remove_file(database.file_path)
         db.session.delete(database)
     
     db.session.delete(project)
@@ -1338,8 +1351,7 @@ def delete_cohort(cohort_id):
     
     # Delete all spreadsheets in the cohort
     for spreadsheet in cohort.spreadsheets:
-        if spreadsheet.file_path and os.path.exists(spreadsheet.file_path):
-            os.remove(spreadsheet.file_path)
+        remove_file(spreadsheet.file_path)
         db.session.delete(spreadsheet)
     
     db.session.delete(cohort)
@@ -1376,8 +1388,7 @@ def delete_database(database_id):
     database = Database.query.get_or_404(database_id)
     project_id = database.project_id
     
-    if database.file_path and os.path.exists(database.file_path):
-        os.remove(database.file_path)
+    remove_file(database.file_path)
     
     db.session.delete(database)
     db.session.commit()
@@ -1404,8 +1415,7 @@ def delete_spreadsheet(spreadsheet_id):
     spreadsheet = Spreadsheet.query.get_or_404(spreadsheet_id)
     cohort_id = spreadsheet.cohort_id
     
-    if spreadsheet.file_path and os.path.exists(spreadsheet.file_path):
-        os.remove(spreadsheet.file_path)
+    remove_file(spreadsheet.file_path)
     
     db.session.delete(spreadsheet)
     db.session.commit()
@@ -1446,8 +1456,8 @@ def create_spreadsheet(cohort_id):
             name=name,
             filename=filename,
             file_path=file_path,
-            sheet_names=json.dumps(['Sheet1']),
-            columns_info=json.dumps({
+            sheet_names=dumps_json(['Sheet1']),
+            columns_info=dumps_json({
                 'columns': [openpyxl.utils.get_column_letter(i) for i in range(1, cols + 1)],
                 'total_rows': rows,
                 'sheets': ['Sheet1']
@@ -1576,7 +1586,7 @@ def recreate_spreadsheet(spreadsheet_id):
             'total_rows': 10,
             'sheets': ['Sheet1']
         }
-        spreadsheet.columns_info = json.dumps(columns_info, cls=DateTimeEncoder)
+        spreadsheet.columns_info = dumps_json(columns_info)
         spreadsheet.updated_at = datetime.utcnow()
         db.session.commit()
         
@@ -1642,7 +1652,7 @@ def save_spreadsheet(spreadsheet_id):
                     'total_rows': metadata.get('rows', len(data)),
                     'sheets': ['Sheet1']
                 }
-                spreadsheet.columns_info = json.dumps(columns_info, cls=DateTimeEncoder)
+                spreadsheet.columns_info = dumps_json(columns_info)
         
         spreadsheet.updated_at = datetime.utcnow()
         db.session.commit()
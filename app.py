@@ -3,6 +3,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 import os
 import pandas as pd
+import openpyxl
 import pyodbc
 import psycopg2
 from datetime import datetime
@@ -15,6 +16,14 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///db_manager.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+    # The pool is per process; gunicorn-gevent.conf.py sets these so that all
+    # workers together stay under the server's max_connections
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', '5')),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', '5')),
+        'pool_pre_ping': True,
+    }
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
@@ -39,13 +48,13 @@ class Database(db.Model):
     type = db.Column(db.String(20), nullable=False)  # postgresql, access, excel
     connection_string = db.Column(db.Text)
     file_path = db.Column(db.String(500))
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class ImportLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    database_id = db.Column(db.Integer, db.ForeignKey('database.id'), nullable=False)
+    database_id = db.Column(db.Integer, db.ForeignKey('database.id'), nullable=False, index=True)
     import_type = db.Column(db.String(20), nullable=False)  # access, excel
     status = db.Column(db.String(20), nullable=False)  # success, failed
     message = db.Column(db.Text)
@@ -205,8 +214,15 @@ def import_access_database(database):
 def import_excel_database(database):
     """Import Excel file to PostgreSQL"""
     try:
-        # Read Excel file
-        df = pd.read_excel(database.file_path)
+        # Only the row count is used, so stream the first sheet's rows instead
+        # of loading every cell into a DataFrame; openpyxl cannot open .xls
+        if database.file_path.lower().endswith('.xls'):
+            row_count = len(pd.read_excel(database.file_path))
+        else:
+            wb = openpyxl.load_workbook(database.file_path, read_only=True, data_only=True)
+            # The header row is not counted, as with read_excel
+            row_count = max(sum(1 for _ in wb.worksheets[0].iter_rows(values_only=True)) - 1, 0)
+            wb.close()
         
         # This is a simplified version - you'll need to implement the actual import logic
         # based on your specific requirements
@@ -215,7 +231,7 @@ def import_excel_database(database):
             database_id=database.id,
             import_type='excel',
             status='success',
-            message=f'Excel file imported with {len(df)} rows'
+            message=f'Excel file imported with {row_count} rows'
         )
         db.session.add(log)
         db.session.commit()
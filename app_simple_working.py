@@ -1,49 +1,109 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash, session
 from flask_sqlalchemy import SQLAlchemy
 import os
-from datetime import datetime, timedelta
-import hashlib
+from datetime import datetime, timedelta, timezone
+import orjson
 import secrets
-from collections import defaultdict
+import socket
+import threading
+import time
+from functools import lru_cache, wraps
+from itertools import count
 from dotenv import load_dotenv
+from avencion_common import OrjsonProvider, check_credentials
+from sqlalchemy import insert, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import selectinload
 
 # Load environment variables
 load_dotenv()
 
-# Rate limiting for login attempts
-login_attempts = defaultdict(list)
+# Rate limiting for login attempts: each IP has a bucket of MAX_LOGIN_ATTEMPTS
+# failed logins that refills completely over LOGIN_TIMEOUT
 MAX_LOGIN_ATTEMPTS = 5
 LOGIN_TIMEOUT = 300  # 5 minutes
-
-# Authentication configuration
-AVENCION_USERNAME = "Avencion"
-AVENCION_PASSWORD_HASH = hashlib.sha256("AvencionData@Center2025".encode()).hexdigest()
+LOGIN_REFILL_RATE = MAX_LOGIN_ATTEMPTS / LOGIN_TIMEOUT  # Attempts regained per second
+LOGIN_SWEEP_INTERVAL = 1000  # Login posts between sweeps of refilled buckets
+login_buckets = {}  # Packed IP address -> (attempts left, time.monotonic() of last failure)
+login_post_counter = count(1)
+
+def login_bucket_key(client_ip):
+    """Pack client_ip into its 4 (IPv4) or 16 (IPv6) address bytes"""
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            return socket.inet_pton(family, client_ip)
+        except (OSError, TypeError):
+            pass
+    return (client_ip or '').encode()
+
+def login_attempts_left(key, now):
+    """Failed logins key may still make, counting the refill since its last one"""
+    tokens, last = login_buckets.get(key, (MAX_LOGIN_ATTEMPTS, now))
+    return min(MAX_LOGIN_ATTEMPTS, tokens + (now - last) * LOGIN_REFILL_RATE)
+
+def sweep_login_buckets(now):
+    """Forget IPs whose buckets have refilled completely"""
+    for key in [key for key in login_buckets if login_attempts_left(key, now) >= MAX_LOGIN_ATTEMPTS]:
+        del login_buckets[key]
+
+@lru_cache(maxsize=32)
+def fixed_url(endpoint, script_root):
+    """URL of an endpoint that takes no arguments, built once per script root"""
+    return url_for(endpoint)
+
+def redirect_to(endpoint):
+    """Redirect to an endpoint that takes no arguments"""
+    return redirect(fixed_url(endpoint, request.script_root))
 
 def login_required(f):
     """Decorator to require authentication for routes"""
+    @wraps(f)
     def decorated_function(*args, **kwargs):
         if not session.get('authenticated'):
-            return redirect(url_for('login'))
+            return redirect_to('login')
         return f(*args, **kwargs)
-    decorated_function.__name__ = f.__name__
     return decorated_function
 
 # Create Flask app
 app = Flask(__name__)
+app.config['DEBUG'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
+app.json = OrjsonProvider(app)  # Compact, unsorted output serialized in C
 
 # Database configuration - simple and reliable
 DATABASE_URL = os.environ.get('DATABASE_URL')
 if DATABASE_URL and 'postgresql://' in DATABASE_URL:
     app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
-    print("✅ Using PostgreSQL database")
+    # Keep enough connections for concurrent requests, hand out the most
+    # recently used one first so warm connections are reused, and replace
+    # connections the server closed while idle. The pool is per process, so
+    # its size comes from the environment, where the gunicorn config splits
+    # the server's connection limit across the workers
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', '5')),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', '5')),
+        'pool_recycle': 300,
+        'pool_pre_ping': True, 'pool_use_lifo': True,
+    }
+    app.logger.debug("Using PostgreSQL database")
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db_manager.db'
-    print("✅ Using SQLite database")
+    app.logger.debug("Using SQLite database")
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+def mask_database_uri(uri):
+    """The database URI with its credentials replaced by asterisks"""
+    url = make_url(uri)
+    if url.username is None and url.password is None:
+        return uri
+    return url.set(username='***', password='***').render_as_string(hide_password=False)
+
+# Reported by /test-db; the URI is fixed for the life of the process
+MASKED_DATABASE_URI = mask_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+
 # Initialize SQLAlchemy
 db = SQLAlchemy(app)
 
@@ -57,24 +117,80 @@ class Project(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     cohorts = db.relationship('Cohort', backref='project', lazy=True, cascade='all, delete-orphan')
+    __table_args__ = (db.Index('ix_project_created_at', 'created_at'),)
 
 class Cohort(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     created_by = db.Column(db.String(100), default='Avencion')
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+# Create the tables once per process rather than in every handler. If the
+# database cannot be reached at import (a cold start racing the database),
+# the first request that finds it reachable creates them instead
+tables_ready = False
+tables_lock = threading.Lock()
+
+def ensure_tables():
+    """Create any missing tables and indexes, once"""
+    global tables_ready
+    with tables_lock:
+        if not tables_ready:
+            db.create_all()
+            # create_all skips existing tables, so add indexes they predate
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(db.engine, checkfirst=True)
+            tables_ready = True
+
+try:
+    with app.app_context():
+        ensure_tables()
+except SQLAlchemyError as e:
+    app.logger.warning("Could not create database tables at startup: %s", e)
+
+@app.before_request
+def create_tables_on_first_request():
+    if not tables_ready:
+        try:
+            ensure_tables()
+        except SQLAlchemyError as e:
+            # The handlers report the database error to the user themselves
+            app.logger.warning("Could not create database tables: %s", e)
+
+# The landing page's project rows, kept for a short while so repeat views skip
+# the query. Views that change a project or its cohort count reset it; other
+# worker processes may show a change up to PROJECT_LIST_TTL seconds late
+PROJECT_LIST_TTL = 60
+project_list_cache = None  # (time.monotonic() expiry, project rows)
+
+def invalidate_project_list():
+    """Make the next landing page view query the projects again"""
+    global project_list_cache
+    project_list_cache = None
+
 # Simple routes
 @app.route('/')
 @login_required
 def index():
+    global project_list_cache
     try:
-        with app.app_context():
-            db.create_all()
-            projects = Project.query.order_by(Project.created_at.desc()).all()
+        cached = project_list_cache
+        if cached is not None and cached[0] > time.monotonic():
+            projects = cached[1]
+        else:
+            # The cards are read-only, so fetch plain rows of just the fields they
+            # show, with each project's cohort count computed in the same query
+            cohort_count = db.select(db.func.count(Cohort.id)).where(Cohort.project_id == Project.id).scalar_subquery()
+            projects = db.session.execute(
+                db.select(Project.id, Project.name, Project.description, Project.project_type,
+                          cohort_count.label('cohort_count'))
+                .order_by(Project.created_at.desc())
+            ).all()
+            project_list_cache = (time.monotonic() + PROJECT_LIST_TTL, projects)
         return render_template('index.html', projects=projects)
     except Exception as e:
         return jsonify({'error': 'Index error', 'details': str(e)}), 500
@@ -85,13 +201,25 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        if username == AVENCION_USERNAME and hashlib.sha256(password.encode()).hexdigest() == AVENCION_PASSWORD_HASH:
+        # Rate limiting check
+        key = login_bucket_key(request.remote_addr)
+        now = time.monotonic()
+        if next(login_post_counter) % LOGIN_SWEEP_INTERVAL == 0:
+            sweep_login_buckets(now)
+        attempts_left = login_attempts_left(key, now)
+        if attempts_left < 1:
+            flash('Too many login attempts. Please try again later.', 'error')
+            return render_template('login.html')
+        
+        if check_credentials(username, password):
+            login_buckets.pop(key, None)
             session.permanent = True
             session['authenticated'] = True
             session['username'] = username
             flash('Welcome to Avencion Data Center!', 'success')
-            return redirect(url_for('index'))
+            return redirect_to('index')
         else:
+            login_buckets[key] = (attempts_left - 1, now)
             flash('Invalid credentials. Please try again.', 'error')
     
     return render_template('login.html')
@@ -100,25 +228,25 @@ def login():
 def logout():
     session.clear()
     flash('You have been logged out successfully.', 'success')
-    return redirect(url_for('login'))
+    return redirect_to('login')
 
 @app.route('/project/new', methods=['GET', 'POST'])
 @login_required
 def new_project():
     if request.method == 'POST':
         try:
-            with app.app_context():
-                db.create_all()
-                project = Project(
-                    name=request.form['name'],
-                    description=request.form['description'],
-                    project_type=request.form['project_type'],
-                    created_by=request.form.get('created_by', 'Avencion')
-                )
-                db.session.add(project)
-                db.session.commit()
+            form = request.form.to_dict()
+            project = Project(
+                name=form['name'],
+                description=form['description'],
+                project_type=form['project_type'],
+                created_by=form.get('created_by', 'Avencion')
+            )
+            db.session.add(project)
+            db.session.commit()
+            invalidate_project_list()
             flash('Project created successfully!', 'success')
-            return redirect(url_for('index'))
+            return redirect_to('index')
         except Exception as e:
             return jsonify({'error': 'New project error', 'details': str(e)}), 500
     
@@ -128,9 +256,10 @@ def new_project():
 @login_required
 def project_detail(project_id):
     try:
-        with app.app_context():
-            db.create_all()
-            project = Project.query.get_or_404(project_id)
+        # Fetch the cohorts the page lists with the project, in one IN query
+        project = db.one_or_404(
+            db.select(Project).where(Project.id == project_id).options(selectinload(Project.cohorts))
+        )
         return render_template('project_detail.html', project=project)
     except Exception as e:
         return jsonify({'error': 'Project detail error', 'details': str(e)}), 500
@@ -139,21 +268,29 @@ def project_detail(project_id):
 @login_required
 def new_cohort(project_id):
     try:
-        with app.app_context():
-            db.create_all()
-            project = Project.query.get_or_404(project_id)
+        project = db.get_or_404(Project, project_id)
         
         if request.method == 'POST':
-            with app.app_context():
-                cohort = Cohort(
-                    name=request.form['name'],
-                    description=request.form['description'],
-                    project_id=project_id,
-                    created_by=request.form.get('created_by', 'Avencion')
-                )
-                db.session.add(cohort)
-                db.session.commit()
-            flash('Cohort created successfully!', 'success')
+            # The form may repeat the name field to add several cohorts at
+            # once; they share the description and go in as one INSERT
+            form = request.form.to_dict()
+            description = form['description']
+            created_by = form.get('created_by', 'Avencion')
+            rows = [
+                {'name': name, 'description': description,
+                 'project_id': project_id, 'created_by': created_by}
+                for name in request.form.getlist('name')
+            ]
+            if not rows:
+                flash('Cohort name is required.', 'error')
+                return render_template('new_cohort.html', project=project)
+            db.session.execute(insert(Cohort), rows)
+            db.session.commit()
+            invalidate_project_list()
+            if len(rows) == 1:
+                flash('Cohort created successfully!', 'success')
+            else:
+                flash(f'{len(rows)} cohorts created successfully!', 'success')
             return redirect(url_for('project_detail', project_id=project_id))
         
         return render_template('new_cohort.html', project=project)
@@ -164,9 +301,7 @@ def new_cohort(project_id):
 @login_required
 def cohort_detail(cohort_id):
     try:
-        with app.app_context():
-            db.create_all()
-            cohort = Cohort.query.get_or_404(cohort_id)
+        cohort = db.get_or_404(Cohort, cohort_id)
         return render_template('cohort_detail.html', cohort=cohort)
     except Exception as e:
         return jsonify({'error': 'Cohort detail error', 'details': str(e)}), 500
@@ -176,9 +311,7 @@ def cohort_detail(cohort_id):
 @login_required
 def new_database(project_id):
     try:
-        with app.app_context():
-            db.create_all()
-            project = Project.query.get_or_404(project_id)
+        project = db.get_or_404(Project, project_id)
         if request.method == 'POST':
             flash('Database creation not available in simplified version', 'info')
             return redirect(url_for('project_detail', project_id=project_id))
@@ -195,7 +328,7 @@ def database_tables(database_id):
 @login_required
 def edit_database(database_id):
     flash('Database editing not available in simplified version', 'info')
-    return redirect(url_for('index'))
+    return redirect_to('index')
 
 # Spreadsheet routes (simplified)
 @app.route('/spreadsheet/create/<int:cohort_id>', methods=['GET', 'POST'])
@@ -214,41 +347,41 @@ def upload_spreadsheet(cohort_id):
 @login_required
 def spreadsheet_detail(spreadsheet_id):
     flash('Spreadsheet details not available in simplified version', 'info')
-    return redirect(url_for('index'))
+    return redirect_to('index')
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/view')
 @login_required
 def view_spreadsheet(spreadsheet_id):
     flash('Spreadsheet viewing not available in simplified version', 'info')
-    return redirect(url_for('index'))
+    return redirect_to('index')
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/download')
 @login_required
 def download_spreadsheet(spreadsheet_id):
     flash('File download not available in simplified version', 'info')
-    return redirect(url_for('index'))
+    return redirect_to('index')
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/recreate', methods=['POST'])
 @login_required
 def recreate_spreadsheet(spreadsheet_id):
     flash('Spreadsheet recreation not available in simplified version', 'info')
-    return redirect(url_for('index'))
+    return redirect_to('index')
 
 # Edit routes (simplified)
 @app.route('/project/<int:project_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_project(project_id):
     try:
-        with app.app_context():
-            db.create_all()
-            project = Project.query.get_or_404(project_id)
-            if request.method == 'POST':
-                project.name = request.form['name']
-                project.project_type = request.form['project_type']
-                project.description = request.form.get('description', '')
-                db.session.commit()
-                flash('Project updated successfully!', 'success')
-                return redirect(url_for('project_detail', project_id=project.id))
+        project = db.get_or_404(Project, project_id)
+        if request.method == 'POST':
+            form = request.form.to_dict()
+            project.name = form['name']
+            project.project_type = form['project_type']
+            project.description = form.get('description', '')
+            db.session.commit()
+            invalidate_project_list()
+            flash('Project updated successfully!', 'success')
+            return redirect(url_for('project_detail', project_id=project.id))
         return render_template('edit_project.html', project=project)
     except Exception as e:
         return jsonify({'error': 'Edit project error', 'details': str(e)}), 500
@@ -257,78 +390,107 @@ def edit_project(project_id):
 @login_required
 def edit_cohort(cohort_id):
     try:
-        with app.app_context():
-            db.create_all()
-            cohort = Cohort.query.get_or_404(cohort_id)
-            if request.method == 'POST':
-                cohort.name = request.form['name']
-                cohort.description = request.form.get('description', '')
-                db.session.commit()
-                flash('Cohort updated successfully!', 'success')
-                return redirect(url_for('cohort_detail', cohort_id=cohort.id))
+        cohort = db.get_or_404(Cohort, cohort_id)
+        if request.method == 'POST':
+            form = request.form.to_dict()
+            cohort.name = form['name']
+            cohort.description = form.get('description', '')
+            db.session.commit()
+            flash('Cohort updated successfully!', 'success')
+            return redirect(url_for('cohort_detail', cohort_id=cohort.id))
         return render_template('edit_cohort.html', cohort=cohort)
     except Exception as e:
         return jsonify({'error': 'Edit cohort error', 'details': str(e)}), 500
 
+# The status routes report the time to the second, so build that string once
+# per second rather than on every probe
+last_timestamp = (0, '')  # (whole epoch second, its ISO string)
+
+def utc_timestamp():
+    """The current UTC time as an ISO string with its offset, to whole seconds"""
+    global last_timestamp
+    now = int(time.time())
+    if last_timestamp[0] != now:
+        last_timestamp = (now, datetime.fromtimestamp(now, timezone.utc).isoformat())
+    return last_timestamp[1]
+
+# Built once so the status routes reuse the same statement and its cache key
+DB_PING = text('SELECT 1')
+
 # Test routes
+# Only the timestamp in /test's body changes, so splice it between fixed bytes
+TEST_BODY_PREFIX = b'{"status":"ok","message":"Flask app is running","timestamp":"'
+TEST_BODY_SUFFIX = b'"}'
+
 @app.route('/test')
 def test():
-    return jsonify({
-        'status': 'ok',
-        'message': 'Flask app is running',
-        'timestamp': datetime.utcnow().isoformat()
-    })
+    return Response(TEST_BODY_PREFIX + utc_timestamp().encode() + TEST_BODY_SUFFIX,
+                    mimetype='application/json')
 
 @app.route('/test-db')
 def test_database():
     try:
-        with app.app_context():
-            db.create_all()
-            # Use text() for raw SQL in newer SQLAlchemy versions
-            from sqlalchemy import text
-            db.session.execute(text('SELECT 1'))
-            project_count = Project.query.count()
-            return jsonify({
-                'status': 'success',
-                'message': 'Database connection successful',
-                'database_url': app.config['SQLALCHEMY_DATABASE_URI'].replace('://', '://***:***@') if '@' in app.config['SQLALCHEMY_DATABASE_URI'] else app.config['SQLALCHEMY_DATABASE_URI'],
-                'project_count': project_count,
-                'timestamp': datetime.utcnow().isoformat()
-            })
+        db.session.execute(DB_PING)
+        project_count = db.session.execute(db.select(db.func.count()).select_from(Project)).scalar()
+        return jsonify({
+            'status': 'success',
+            'message': 'Database connection successful',
+            'database_url': MASKED_DATABASE_URI,
+            'project_count': project_count,
+            'timestamp': utc_timestamp()
+        })
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': 'Database connection failed',
             'error': str(e),
-            'database_url': app.config['SQLALCHEMY_DATABASE_URI'].replace('://', '://***:***@') if '@' in app.config['SQLALCHEMY_DATABASE_URI'] else app.config['SQLALCHEMY_DATABASE_URI'],
-            'timestamp': datetime.utcnow().isoformat()
+            'database_url': MASKED_DATABASE_URI,
+            'timestamp': utc_timestamp()
         }), 500
 
-@app.route('/health')
-def health_check():
+# The load balancer's health probes and browsers' favicon requests are the
+# most frequent hits, so answer them before Flask routing, session handling and
+# request hooks run. The health probe still pings the database
+FAVICON_PATHS = frozenset({'/favicon.ico', '/favicon.png'})
+
+def health_status():
+    """Ping the database and return the health probe's status line and body"""
     try:
         with app.app_context():
-            db.create_all()
-            # Use text() for raw SQL in newer SQLAlchemy versions
-            from sqlalchemy import text
-            db.session.execute(text('SELECT 1'))
-        return jsonify({
-            'status': 'healthy', 
-            'timestamp': datetime.utcnow().isoformat(),
+            with db.engine.connect() as connection:
+                connection.execute(DB_PING)
+        return '200 OK', {
+            'status': 'healthy',
+            'timestamp': utc_timestamp(),
             'database': 'connected'
-        })
+        }
     except Exception as e:
-        return jsonify({
-            'status': 'unhealthy', 
-            'timestamp': datetime.utcnow().isoformat(),
+        return '500 INTERNAL SERVER ERROR', {
+            'status': 'unhealthy',
+            'timestamp': utc_timestamp(),
             'error': str(e)
-        }), 500
-
-# Favicon routes
-@app.route('/favicon.ico')
-@app.route('/favicon.png')
-def favicon():
-    return '', 204
+        }
+
+class QuickResponses:
+    """WSGI middleware serving the favicon and health paths ahead of Flask"""
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO')
+        method = environ.get('REQUEST_METHOD')
+        if method not in ('GET', 'HEAD') or (path not in FAVICON_PATHS and path != '/health'):
+            return self.wsgi_app(environ, start_response)
+        if path in FAVICON_PATHS:
+            start_response('204 NO CONTENT', [])
+            return []
+        status, payload = health_status()
+        body = orjson.dumps(payload)
+        start_response(status, [('Content-Type', 'application/json'),
+                                ('Content-Length', str(len(body)))])
+        return [] if method == 'HEAD' else [body]
+
+app.wsgi_app = QuickResponses(app.wsgi_app)
 
 # Help route
 @app.route('/help')
@@ -336,10 +498,5 @@ def favicon():
 def help_page():
     return render_template('help.html')
 
-# For Vercel deployment
-app.debug = False
-
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
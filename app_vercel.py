@@ -2,12 +2,13 @@ from flask import Flask, render_template, request, jsonify, redirect, url_for, f
 from flask_sqlalchemy import SQLAlchemy
 import os
 from datetime import datetime, timedelta
-import json
 import warnings
-import hashlib
 import secrets
-from collections import defaultdict
+from collections import defaultdict, deque
+from functools import wraps
+from itertools import count
 from dotenv import load_dotenv
+from avencion_common import check_credentials
 import traceback
 warnings.filterwarnings('ignore', category=FutureWarning)
 
@@ -15,34 +16,79 @@ warnings.filterwarnings('ignore', category=FutureWarning)
 load_dotenv()
 
 # Rate limiting for login attempts
-login_attempts = defaultdict(list)
 MAX_LOGIN_ATTEMPTS = 5
 LOGIN_TIMEOUT = 300  # 5 minutes
-
-# Custom JSON encoder to handle datetime objects
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
-
-# Authentication configuration
-AVENCION_USERNAME = "Avencion"
-AVENCION_PASSWORD_HASH = hashlib.sha256("AvencionData@Center2025".encode()).hexdigest()
+LOGIN_SWEEP_INTERVAL = 1000  # Login posts between sweeps of idle IPs
+login_attempts = defaultdict(lambda: deque(maxlen=MAX_LOGIN_ATTEMPTS))
+login_post_counter = count(1)
+
+def sweep_login_attempts(cutoff):
+    """Forget IPs whose recorded attempts have all expired"""
+    for ip in [ip for ip, attempts in login_attempts.items() if not attempts or attempts[-1] <= cutoff]:
+        del login_attempts[ip]
+
+def login_attempt_key(client_ip):
+    """Redis key holding the failed login count for client_ip"""
+    return f'login_fail:{client_ip}'
+
+def login_blocked(client_ip, current_time):
+    """Return True once client_ip has used up its failed login attempts"""
+    if login_redis is not None:
+        try:
+            return int(login_redis.get(login_attempt_key(client_ip)) or 0) >= MAX_LOGIN_ATTEMPTS
+        except redis.RedisError as e:
+            # Keep logins working through a Redis outage with this process's own limits
+            app.logger.warning("Redis unavailable, using per-process login limits: %s", e)
+    
+    # Clean old attempts
+    cutoff = current_time - timedelta(seconds=LOGIN_TIMEOUT)
+    if next(login_post_counter) % LOGIN_SWEEP_INTERVAL == 0:
+        sweep_login_attempts(cutoff)
+    attempts = login_attempts.get(client_ip)
+    while attempts and attempts[0] <= cutoff:
+        attempts.popleft()
+    return attempts is not None and len(attempts) >= MAX_LOGIN_ATTEMPTS
+
+def record_failed_login(client_ip, current_time):
+    """Count a failed login for client_ip"""
+    if login_redis is not None:
+        # The window starts at the first failure: SET NX leaves a running one alone
+        key = login_attempt_key(client_ip)
+        pipe = login_redis.pipeline()
+        pipe.set(key, 0, ex=LOGIN_TIMEOUT, nx=True)
+        pipe.incr(key)
+        try:
+            pipe.execute()
+            return
+        except redis.RedisError as e:
+            app.logger.warning("Redis unavailable, using per-process login limits: %s", e)
+    login_attempts[client_ip].append(current_time)
+
+def clear_login_attempts(client_ip):
+    """Forget the failed logins of client_ip after a successful one"""
+    if login_redis is not None:
+        try:
+            login_redis.delete(login_attempt_key(client_ip))
+        except redis.RedisError as e:
+            app.logger.warning("Redis unavailable, using per-process login limits: %s", e)
+    # Also clear any attempts counted here while Redis was unavailable
+    login_attempts.pop(client_ip, None)
 
 def login_required(f):
     """Decorator to require authentication for routes"""
+    @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not session.get('authenticated'):
+        # Resolve the session proxy once for all the checks below
+        current_session = session._get_current_object()
+        if not current_session.get('authenticated'):
             return redirect(url_for('login'))
         
         # Additional session validation
-        if not session.get('session_id') or not session.get('username'):
-            session.clear()
+        if not current_session.get('session_id') or not current_session.get('username'):
+            current_session.clear()
             return redirect(url_for('login'))
         
         return f(*args, **kwargs)
-    decorated_function.__name__ = f.__name__
     return decorated_function
 
 # Initialize database configuration
@@ -55,17 +101,17 @@ def get_database_url():
             # Check if we can use PostgreSQL
             try:
                 import psycopg2
-                print("✅ Using PostgreSQL database from environment")
+                app.logger.debug("Using PostgreSQL database from environment")
                 return DATABASE_URL
             except ImportError:
-                print("⚠️ PostgreSQL URL provided but psycopg2 not available, using SQLite file")
+                app.logger.warning("PostgreSQL URL provided but psycopg2 not available, using SQLite file")
                 return 'sqlite:///db_manager.db'
         else:
-            print("✅ Using database URL from environment")
+            app.logger.debug("Using database URL from environment")
             return DATABASE_URL
     else:
         # Fallback to SQLite file for local development
-        print("✅ Using SQLite file database for local development")
+        app.logger.debug("Using SQLite file database for local development")
         return 'sqlite:///db_manager.db'
 
 # Create Flask app with proper configuration for Vercel
@@ -80,22 +126,37 @@ if os.environ.get('VERCEL'):
         'pool_pre_ping': True,
         'pool_recycle': 300,
     }
-    print("✅ Configured for Vercel's read-only file system")
+    app.logger.debug("Configured for Vercel's read-only file system")
 
+app.config['DEBUG'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)  # Session expires in 24 hours
 
+# Count failed logins in Redis when configured, so the limit holds across all
+# workers; otherwise each process keeps its own bounded history
+login_redis = None
+if os.environ.get('REDIS_URL'):
+    try:
+        import redis
+        login_redis = redis.Redis.from_url(os.environ['REDIS_URL'])
+    except ImportError:
+        app.logger.warning("REDIS_URL provided but redis not available, using per-process login limits")
+
 # Configure for larger payloads (for Vercel)
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max payload size
 
-# Security headers
+# Security headers, fixed for every response
+SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+    'Cache-Control': 'no-store, no-cache, must-revalidate, max-age=0',
+    'Pragma': 'no-cache',
+}
+
 @app.after_request
 def add_security_headers(response):
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
+    response.headers.update(SECURITY_HEADERS)
     return response
 
 # Set database URL
@@ -105,14 +166,14 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Initialize SQLAlchemy with proper error handling for Vercel
 try:
     db = SQLAlchemy(app)
-    print("✅ SQLAlchemy initialized successfully")
+    app.logger.debug("SQLAlchemy initialized successfully")
 except Exception as e:
-    print(f"⚠️ SQLAlchemy initialization error: {e}")
+    app.logger.warning("SQLAlchemy initialization error: %s", e)
     # Fallback: try to initialize without instance path
     if os.environ.get('VERCEL'):
         app.config['INSTANCE_PATH'] = None
         db = SQLAlchemy(app)
-        print("✅ SQLAlchemy initialized with fallback configuration")
+        app.logger.debug("SQLAlchemy initialized with fallback configuration")
     else:
         raise e
 
@@ -139,14 +200,14 @@ class Cohort(db.Model):
 # Error handler for debugging
 @app.errorhandler(500)
 def internal_error(error):
-    app.logger.error(f'Server Error: {error}')
-    app.logger.error(f'Traceback: {traceback.format_exc()}')
+    app.logger.error('Server Error: %s', error)
+    app.logger.error('Traceback: %s', traceback.format_exc())
     return jsonify({'error': 'Internal server error', 'details': str(error)}), 500
 
 @app.errorhandler(Exception)
 def handle_exception(e):
-    app.logger.error(f'Unhandled Exception: {e}')
-    app.logger.error(f'Traceback: {traceback.format_exc()}')
+    app.logger.error('Unhandled Exception: %s', e)
+    app.logger.error('Traceback: %s', traceback.format_exc())
     return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
 
 # Authentication routes
@@ -161,19 +222,15 @@ def login():
             client_ip = request.remote_addr
             current_time = datetime.utcnow()
             
-            # Clean old attempts
-            login_attempts[client_ip] = [attempt for attempt in login_attempts[client_ip] 
-                                       if current_time - attempt < timedelta(seconds=LOGIN_TIMEOUT)]
-            
             # Check if too many attempts
-            if len(login_attempts[client_ip]) >= MAX_LOGIN_ATTEMPTS:
+            if login_blocked(client_ip, current_time):
                 flash('Too many login attempts. Please try again later.', 'error')
                 return render_template('login.html')
             
             # Verify credentials
-            if username == AVENCION_USERNAME and hashlib.sha256(password.encode()).hexdigest() == AVENCION_PASSWORD_HASH:
+            if check_credentials(username, password):
                 # Clear login attempts on successful login
-                login_attempts[client_ip].clear()
+                clear_login_attempts(client_ip)
                 
                 session.permanent = True
                 session['authenticated'] = True
@@ -186,12 +243,12 @@ def login():
                 return redirect(url_for('index'))
             else:
                 # Record failed attempt
-                login_attempts[client_ip].append(current_time)
+                record_failed_login(client_ip, current_time)
                 flash('Invalid credentials. Please try again.', 'error')
         
         return render_template('login.html')
     except Exception as e:
-        app.logger.error(f'Login error: {e}')
+        app.logger.error('Login error: %s', e)
         return jsonify({'error': 'Login error', 'details': str(e)}), 500
 
 @app.route('/logout')
@@ -201,7 +258,7 @@ def logout():
         flash('You have been logged out successfully.', 'success')
         return redirect(url_for('login'))
     except Exception as e:
-        app.logger.error(f'Logout error: {e}')
+        app.logger.error('Logout error: %s', e)
         return jsonify({'error': 'Logout error', 'details': str(e)}), 500
 
 # Main routes
@@ -214,7 +271,7 @@ def index():
             projects = Project.query.options(db.joinedload(Project.cohorts)).order_by(Project.created_at.desc()).all()
         return render_template('index.html', projects=projects)
     except Exception as e:
-        app.logger.error(f'Index error: {e}')
+        app.logger.error('Index error: %s', e)
         return jsonify({'error': 'Index error', 'details': str(e)}), 500
 
 @app.route('/project/new', methods=['GET', 'POST'])
@@ -237,7 +294,7 @@ def new_project():
         
         return render_template('new_project.html')
     except Exception as e:
-        app.logger.error(f'New project error: {e}')
+        app.logger.error('New project error: %s', e)
         return jsonify({'error': 'New project error', 'details': str(e)}), 500
 
 @app.route('/project/<int:project_id>')
@@ -249,7 +306,7 @@ def project_detail(project_id):
             project = Project.query.options(db.joinedload(Project.cohorts)).get_or_404(project_id)
         return render_template('project_detail.html', project=project)
     except Exception as e:
-        app.logger.error(f'Project detail error: {e}')
+        app.logger.error('Project detail error: %s', e)
         return jsonify({'error': 'Project detail error', 'details': str(e)}), 500
 
 @app.route('/cohort/new/<int:project_id>', methods=['GET', 'POST'])
@@ -275,7 +332,7 @@ def new_cohort(project_id):
         
         return render_template('new_cohort.html', project=project)
     except Exception as e:
-        app.logger.error(f'New cohort error: {e}')
+        app.logger.error('New cohort error: %s', e)
         return jsonify({'error': 'New cohort error', 'details': str(e)}), 500
 
 @app.route('/cohort/<int:cohort_id>')
@@ -287,7 +344,7 @@ def cohort_detail(cohort_id):
             cohort = Cohort.query.options(db.joinedload(Cohort.project)).get_or_404(cohort_id)
         return render_template('cohort_detail.html', cohort=cohort)
     except Exception as e:
-        app.logger.error(f'Cohort detail error: {e}')
+        app.logger.error('Cohort detail error: %s', e)
         return jsonify({'error': 'Cohort detail error', 'details': str(e)}), 500
 
 # Edit routes
@@ -296,7 +353,7 @@ def cohort_detail(cohort_id):
 def edit_project(project_id):
     try:
         with app.app_context():
-            project = Project.query.get_or_404(project_id)
+            project = db.get_or_404(Project, project_id)
             
             if request.method == 'POST':
                 project.name = request.form['name']
@@ -309,7 +366,7 @@ def edit_project(project_id):
             
         return render_template('edit_project.html', project=project)
     except Exception as e:
-        app.logger.error(f'Edit project error: {e}')
+        app.logger.error('Edit project error: %s', e)
         return jsonify({'error': 'Edit project error', 'details': str(e)}), 500
 
 @app.route('/cohort/<int:cohort_id>/edit', methods=['GET', 'POST'])
@@ -317,7 +374,7 @@ def edit_project(project_id):
 def edit_cohort(cohort_id):
     try:
         with app.app_context():
-            cohort = Cohort.query.get_or_404(cohort_id)
+            cohort = db.get_or_404(Cohort, cohort_id)
             
             if request.method == 'POST':
                 cohort.name = request.form['name']
@@ -329,7 +386,7 @@ def edit_cohort(cohort_id):
             
         return render_template('edit_cohort.html', cohort=cohort)
     except Exception as e:
-        app.logger.error(f'Edit cohort error: {e}')
+        app.logger.error('Edit cohort error: %s', e)
         return jsonify({'error': 'Edit cohort error', 'details': str(e)}), 500
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/edit', methods=['GET', 'POST'])
@@ -341,7 +398,7 @@ def edit_spreadsheet(spreadsheet_id):
             flash('Edit functionality not available in simplified version', 'info')
             return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
     except Exception as e:
-        app.logger.error(f'Edit spreadsheet error: {e}')
+        app.logger.error('Edit spreadsheet error: %s', e)
         return jsonify({'error': 'Edit spreadsheet error', 'details': str(e)}), 500
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/edit-online')
@@ -353,7 +410,7 @@ def edit_spreadsheet_online(spreadsheet_id):
             flash('Online editing not available in simplified version', 'info')
             return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
     except Exception as e:
-        app.logger.error(f'Edit spreadsheet online error: {e}')
+        app.logger.error('Edit spreadsheet online error: %s', e)
         return jsonify({'error': 'Edit spreadsheet online error', 'details': str(e)}), 500
 
 # Database routes (simplified for Vercel)
@@ -362,7 +419,7 @@ def edit_spreadsheet_online(spreadsheet_id):
 def new_database(project_id):
     try:
         with app.app_context():
-            project = Project.query.get_or_404(project_id)
+            project = db.get_or_404(Project, project_id)
         
         if request.method == 'POST':
             flash('Database creation not available in simplified version', 'info')
@@ -370,7 +427,7 @@ def new_database(project_id):
         
         return render_template('new_database.html', project=project)
     except Exception as e:
-        app.logger.error(f'New database error: {e}')
+        app.logger.error('New database error: %s', e)
         return jsonify({'error': 'New database error', 'details': str(e)}), 500
 
 @app.route('/database/<int:database_id>/tables')
@@ -380,7 +437,7 @@ def database_tables(database_id):
         # For simplified version, return empty tables list
         return jsonify({'tables': []})
     except Exception as e:
-        app.logger.error(f'Database tables error: {e}')
+        app.logger.error('Database tables error: %s', e)
         return jsonify({'error': 'Database tables error', 'details': str(e)}), 500
 
 @app.route('/database/<int:database_id>/edit', methods=['GET', 'POST'])
@@ -392,7 +449,7 @@ def edit_database(database_id):
             flash('Database editing not available in simplified version', 'info')
             return redirect(url_for('project_detail', project_id=1))  # Fallback
     except Exception as e:
-        app.logger.error(f'Edit database error: {e}')
+        app.logger.error('Edit database error: %s', e)
         return jsonify({'error': 'Edit database error', 'details': str(e)}), 500
 
 # Spreadsheet routes (simplified for Vercel)
@@ -405,7 +462,7 @@ def create_spreadsheet(cohort_id):
             flash('Spreadsheet creation not available in simplified version', 'info')
             return redirect(url_for('cohort_detail', cohort_id=cohort_id))
     except Exception as e:
-        app.logger.error(f'Create spreadsheet error: {e}')
+        app.logger.error('Create spreadsheet error: %s', e)
         return jsonify({'error': 'Create spreadsheet error', 'details': str(e)}), 500
 
 @app.route('/spreadsheet/upload/<int:cohort_id>', methods=['GET', 'POST'])
@@ -417,7 +474,7 @@ def upload_spreadsheet(cohort_id):
             flash('File upload not available in simplified version', 'info')
             return redirect(url_for('cohort_detail', cohort_id=cohort_id))
     except Exception as e:
-        app.logger.error(f'Upload spreadsheet error: {e}')
+        app.logger.error('Upload spreadsheet error: %s', e)
         return jsonify({'error': 'Upload spreadsheet error', 'details': str(e)}), 500
 
 @app.route('/spreadsheet/<int:spreadsheet_id>')
@@ -429,7 +486,7 @@ def spreadsheet_detail(spreadsheet_id):
             flash('Spreadsheet details not available in simplified version', 'info')
             return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
     except Exception as e:
-        app.logger.error(f'Spreadsheet detail error: {e}')
+        app.logger.error('Spreadsheet detail error: %s', e)
         return jsonify({'error': 'Spreadsheet detail error', 'details': str(e)}), 500
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/view')
@@ -441,7 +498,7 @@ def view_spreadsheet(spreadsheet_id):
             flash('Spreadsheet viewing not available in simplified version', 'info')
             return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
     except Exception as e:
-        app.logger.error(f'View spreadsheet error: {e}')
+        app.logger.error('View spreadsheet error: %s', e)
         return jsonify({'error': 'View spreadsheet error', 'details': str(e)}), 500
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/download')
@@ -453,7 +510,7 @@ def download_spreadsheet(spreadsheet_id):
             flash('File download not available in simplified version', 'info')
             return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
     except Exception as e:
-        app.logger.error(f'Download spreadsheet error: {e}')
+        app.logger.error('Download spreadsheet error: %s', e)
         return jsonify({'error': 'Download spreadsheet error', 'details': str(e)}), 500
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/recreate', methods=['POST'])
@@ -465,7 +522,7 @@ def recreate_spreadsheet(spreadsheet_id):
             flash('Spreadsheet recreation not available in simplified version', 'info')
             return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
     except Exception as e:
-        app.logger.error(f'Recreate spreadsheet error: {e}')
+        app.logger.error('Recreate spreadsheet error: %s', e)
         return jsonify({'error': 'Recreate spreadsheet error', 'details': str(e)}), 500
 
 @app.route('/help')
@@ -474,7 +531,7 @@ def help_page():
     try:
         return render_template('help.html')
     except Exception as e:
-        app.logger.error(f'Help error: {e}')
+        app.logger.error('Help error: %s', e)
         return jsonify({'error': 'Help error', 'details': str(e)}), 500
 
 # Health check for Vercel
@@ -490,7 +547,7 @@ def health_check():
             'database': 'connected'
         })
     except Exception as e:
-        app.logger.error(f'Health check error: {e}')
+        app.logger.error('Health check error: %s', e)
         return jsonify({
             'status': 'unhealthy', 
             'timestamp': datetime.utcnow().isoformat(),
@@ -521,7 +578,7 @@ def test_database():
                 'timestamp': datetime.utcnow().isoformat()
             })
     except Exception as e:
-        app.logger.error(f'Database test error: {e}')
+        app.logger.error('Database test error: %s', e)
         return jsonify({
             'status': 'error',
             'message': 'Database connection failed',
@@ -545,9 +602,6 @@ def test():
 def favicon():
     return '', 204  # No content response
 
-# For Vercel deployment
-app.debug = False
-
 if __name__ == '__main__':
     with app.app_context():
         try:
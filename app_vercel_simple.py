@@ -1,48 +1,106 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, abort, render_template, request, jsonify, redirect, url_for, flash, session
 from flask_sqlalchemy import SQLAlchemy
 import os
-from datetime import datetime, timedelta
-import json
-import warnings
-import hashlib
+from datetime import datetime, timedelta, timezone
+import importlib.util
+import orjson
 import secrets
-from collections import defaultdict
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+from itertools import count
 from dotenv import load_dotenv
-import traceback
-warnings.filterwarnings('ignore', category=FutureWarning)
+from avencion_common import OrjsonProvider, check_credentials
+from sqlalchemy import insert, literal, text, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import selectinload
+from werkzeug.exceptions import HTTPException
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Rate limiting for login attempts
-login_attempts = defaultdict(list)
 MAX_LOGIN_ATTEMPTS = 5
 LOGIN_TIMEOUT = 300  # 5 minutes
-
-# Custom JSON encoder to handle datetime objects
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
-
-# Authentication configuration
-AVENCION_USERNAME = "Avencion"
-AVENCION_PASSWORD_HASH = hashlib.sha256("AvencionData@Center2025".encode()).hexdigest()
+LOGIN_SWEEP_INTERVAL = 1000  # Login posts between sweeps of idle IPs
+login_attempts = defaultdict(lambda: deque(maxlen=MAX_LOGIN_ATTEMPTS))
+login_post_counter = count(1)
+
+def sweep_login_attempts(cutoff):
+    """Forget IPs whose recorded attempts have all expired"""
+    for ip in [ip for ip, attempts in login_attempts.items() if not attempts or attempts[-1] <= cutoff]:
+        del login_attempts[ip]
+
+def login_attempt_key(client_ip):
+    """Redis sorted set of client_ip's failed login times"""
+    return f'login_window:{client_ip}'
+
+def login_blocked(client_ip, current_time):
+    """Return True once client_ip has used up its failed login attempts"""
+    if redis_client is not None:
+        # Sliding window: drop failures older than LOGIN_TIMEOUT, count the rest.
+        # Wall-clock time, since every instance shares these timestamps
+        key = login_attempt_key(client_ip)
+        pipe = redis_client.pipeline()
+        pipe.zremrangebyscore(key, 0, time.time() - LOGIN_TIMEOUT)
+        pipe.zcard(key)
+        try:
+            return pipe.execute()[1] >= MAX_LOGIN_ATTEMPTS
+        except redis.RedisError as e:
+            # Keep logins working through a Redis outage with this process's own limits
+            app.logger.warning("Redis unavailable, using per-process login limits: %s", e)
+    
+    # Clean old attempts
+    cutoff = current_time - LOGIN_TIMEOUT
+    if next(login_post_counter) % LOGIN_SWEEP_INTERVAL == 0:
+        sweep_login_attempts(cutoff)
+    attempts = login_attempts.get(client_ip)
+    while attempts and attempts[0] <= cutoff:
+        attempts.popleft()
+    return attempts is not None and len(attempts) >= MAX_LOGIN_ATTEMPTS
+
+def record_failed_login(client_ip, current_time):
+    """Count a failed login for client_ip"""
+    if redis_client is not None:
+        # Random members keep failures in the same instant distinct; the key
+        # expires once the newest failure has left the window
+        key = login_attempt_key(client_ip)
+        pipe = redis_client.pipeline()
+        pipe.zadd(key, {secrets.token_hex(8): time.time()})
+        pipe.expire(key, LOGIN_TIMEOUT)
+        try:
+            pipe.execute()
+            return
+        except redis.RedisError as e:
+            app.logger.warning("Redis unavailable, using per-process login limits: %s", e)
+    login_attempts[client_ip].append(current_time)
+
+def clear_login_attempts(client_ip):
+    """Forget the failed logins of client_ip after a successful one"""
+    if redis_client is not None:
+        try:
+            redis_client.delete(login_attempt_key(client_ip))
+        except redis.RedisError as e:
+            app.logger.warning("Redis unavailable, using per-process login limits: %s", e)
+    # Also clear any attempts counted here while Redis was unavailable
+    login_attempts.pop(client_ip, None)
 
 def login_required(f):
     """Decorator to require authentication for routes"""
+    @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not session.get('authenticated'):
+        # Resolve the session proxy once for all the checks below
+        current_session = session._get_current_object()
+        if not current_session.get('authenticated'):
             return redirect(url_for('login'))
         
         # Additional session validation
-        if not session.get('session_id') or not session.get('username'):
-            session.clear()
+        if not current_session.get('session_id') or not current_session.get('username'):
+            current_session.clear()
             return redirect(url_for('login'))
         
         return f(*args, **kwargs)
-    decorated_function.__name__ = f.__name__
     return decorated_function
 
 # Initialize database configuration
@@ -52,81 +110,147 @@ def get_database_url():
     
     if DATABASE_URL:
         if 'postgresql://' in DATABASE_URL:
-            # Check if we can use PostgreSQL
-            try:
-                import psycopg2
-                print("✅ Using PostgreSQL database from environment")
+            # Check the driver is installed without importing it here; the
+            # engine imports it itself when it is created
+            if importlib.util.find_spec('psycopg2') is not None:
+                app.logger.debug("Using PostgreSQL database from environment")
                 return DATABASE_URL
-            except ImportError:
-                print("⚠️ PostgreSQL URL provided but psycopg2 not available, using SQLite file")
-                return 'sqlite:///db_manager.db'
+            app.logger.warning("PostgreSQL URL provided but psycopg2 not available, using SQLite file")
+            return 'sqlite:///db_manager.db'
         else:
-            print("✅ Using database URL from environment")
+            app.logger.debug("Using database URL from environment")
             return DATABASE_URL
     else:
         # Fallback to SQLite file for local development
-        print("✅ Using SQLite file database for local development")
+        app.logger.debug("Using SQLite file database for local development")
         return 'sqlite:///db_manager.db'
 
 # Create Flask app with proper configuration for Vercel
 app = Flask(__name__)
 
-# Configure Flask for Vercel's read-only file system
-if os.environ.get('VERCEL'):
-    # Disable instance path creation for SQLAlchemy
-    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-        'pool_pre_ping': True,
-        'pool_recycle': 300,
-    }
-    print("✅ Configured for Vercel's read-only file system")
-
+app.config['DEBUG'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)  # Session expires in 24 hours
+app.json = OrjsonProvider(app)  # Compact, unsorted output serialized in C
+
+# Count failed logins and cache the project list in Redis when configured, so
+# both are shared by all workers; otherwise each process keeps its own bounded
+# login history and the landing page queries the database every time
+redis_client = None
+if os.environ.get('REDIS_URL'):
+    try:
+        import redis
+        redis_client = redis.Redis.from_url(os.environ['REDIS_URL'])
+    except ImportError:
+        app.logger.warning("REDIS_URL provided but redis not available, using per-process login limits and no project cache")
+
+# With Redis available, keep sessions server-side: the cookie carries only a
+# signed session id, and logging out deletes the stored session outright
+if redis_client is not None:
+    try:
+        from flask_session import Session
+        app.config.update(
+            SESSION_TYPE='redis',
+            SESSION_REDIS=redis_client,
+            SESSION_PERMANENT=True,
+            SESSION_USE_SIGNER=True,
+        )
+        Session(app)
+    except ImportError:
+        app.logger.warning("REDIS_URL provided but Flask-Session not available, using cookie sessions")
 
 # Configure for larger payloads (for Vercel)
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max payload size
 
-# Security headers
+# Security headers, fixed for every response
+SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+    'Cache-Control': 'no-store, no-cache, must-revalidate, max-age=0',
+    'Pragma': 'no-cache',
+}
+
 @app.after_request
 def add_security_headers(response):
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
+    response.headers.update(SECURITY_HEADERS)
     return response
 
-# Set database URL
-app.config['SQLALCHEMY_DATABASE_URI'] = get_database_url()
+def mask_database_uri(uri):
+    """The database URI with its credentials replaced by asterisks"""
+    url = make_url(uri)
+    if url.username is None and url.password is None:
+        return uri
+    return url.set(username='***', password='***').render_as_string(hide_password=False)
+
+# Set database URL; it is fixed for the life of the process, so resolve it and
+# the masked form /test-db reports just once
+DATABASE_URI = get_database_url()
+MASKED_DATABASE_URI = mask_database_uri(DATABASE_URI)
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if DATABASE_URI.startswith('postgresql'):
+    if os.environ.get('VERCEL'):
+        # A function instance serves one request at a time but stays warm
+        # between them, so keep one connection for reuse with a little
+        # headroom, and give up quickly instead of hanging the invocation
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': 1, 'max_overflow': 2, 'pool_timeout': 5,
+            'pool_recycle': 300, 'pool_pre_ping': True,
+            'connect_args': {'connect_timeout': 3},
+        }
+    else:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': 5, 'max_overflow': 10,
+            'pool_recycle': 300, 'pool_pre_ping': True,
+        }
+
+# Create the tables once per process rather than in every handler; until
+# that succeeds (e.g. the database is unreachable), each request retries it
+tables_ready = False
+tables_lock = threading.Lock()
 
-# Database initialization function
 def init_database_tables():
-    """Initialize database tables when needed"""
-    try:
-        with app.app_context():
-            db.create_all()
-            print("✅ Database tables created successfully")
+    """Create any missing database tables and indexes, once"""
+    global tables_ready, table_names
+    with tables_lock:
+        if tables_ready:
             return True
-    except Exception as e:
-        print(f"⚠️ Database table creation error: {e}")
-        print("🔄 Continuing without database tables")
-        return False
+        try:
+            with app.app_context():
+                db.create_all()
+                # create_all skips existing tables, so add indexes they predate
+                for table in db.metadata.sorted_tables:
+                    for index in table.indexes:
+                        index.create(db.engine, checkfirst=True)
+        except Exception as e:
+            app.logger.warning("Database table creation error: %s", e)
+            app.logger.warning("Continuing without database tables")
+            return False
+        app.logger.debug("Database tables created successfully")
+        tables_ready = True
+        table_names = None
+        return True
 
 # Initialize SQLAlchemy with proper error handling for Vercel
 try:
     db = SQLAlchemy(app)
-    print("✅ SQLAlchemy initialized successfully")
+    app.logger.debug("SQLAlchemy initialized successfully")
 except Exception as e:
-    print(f"⚠️ SQLAlchemy initialization error: {e}")
+    app.logger.warning("SQLAlchemy initialization error: %s", e)
     # Fallback: try to initialize without instance path
     if os.environ.get('VERCEL'):
         app.config['INSTANCE_PATH'] = None
         db = SQLAlchemy(app)
-        print("✅ SQLAlchemy initialized with fallback configuration")
+        app.logger.debug("SQLAlchemy initialized with fallback configuration")
     else:
         raise e
 
+@app.before_request
+def create_tables_on_first_request():
+    if not tables_ready:
+        init_database_tables()
+
 # Models
 class Project(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -137,550 +261,495 @@ class Project(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     cohorts = db.relationship('Cohort', backref='project', lazy=True, cascade='all, delete-orphan')
+    # Matches the landing page's keyset ordering, newest first
+    __table_args__ = (db.Index('ix_project_created_at_id', 'created_at', 'id'),)
 
 class Cohort(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     created_by = db.Column(db.String(100), nullable=False, default='Avencion')
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 # Error handler for debugging
 @app.errorhandler(500)
 def internal_error(error):
-    app.logger.error(f'Server Error: {error}')
-    app.logger.error(f'Traceback: {traceback.format_exc()}')
+    app.logger.error('Server Error: %s', error)
     return jsonify({'error': 'Internal server error', 'details': str(error)}), 500
 
+# The views let their errors propagate to here rather than each catching them
 @app.errorhandler(Exception)
 def handle_exception(e):
-    app.logger.error(f'Unhandled Exception: {e}')
-    app.logger.error(f'Traceback: {traceback.format_exc()}')
+    # HTTP errors such as the views' 404s keep their own status
+    if isinstance(e, HTTPException):
+        return e
+    app.logger.exception('Unhandled exception on %s %s: %s', request.method, request.path, e)
     return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
 
 # Authentication routes
 @app.route('/login', methods=['GET', 'POST'])
 def login():
-    try:
-        if request.method == 'POST':
-            username = request.form.get('username')
-            password = request.form.get('password')
-            
-            # Rate limiting check
-            client_ip = request.remote_addr
-            current_time = datetime.utcnow()
-            
-            # Clean old attempts
-            login_attempts[client_ip] = [attempt for attempt in login_attempts[client_ip] 
-                                       if current_time - attempt < timedelta(seconds=LOGIN_TIMEOUT)]
-            
-            # Check if too many attempts
-            if len(login_attempts[client_ip]) >= MAX_LOGIN_ATTEMPTS:
-                flash('Too many login attempts. Please try again later.', 'error')
-                return render_template('login.html')
-            
-            # Verify credentials
-            if username == AVENCION_USERNAME and hashlib.sha256(password.encode()).hexdigest() == AVENCION_PASSWORD_HASH:
-                # Clear login attempts on successful login
-                login_attempts[client_ip].clear()
-                
-                session.permanent = True
-                session['authenticated'] = True
-                session['username'] = username
-                session['login_time'] = current_time.isoformat()
-                session['session_id'] = secrets.token_hex(16)
-                session['ip_address'] = client_ip
-                
-                flash('Welcome to Avencion Data Center!', 'success')
-                return redirect(url_for('index'))
-            else:
-                # Record failed attempt
-                login_attempts[client_ip].append(current_time)
-                flash('Invalid credentials. Please try again.', 'error')
+    if request.method == 'POST':
+        username = request.form.get('username')
+        password = request.form.get('password')
         
-        return render_template('login.html')
-    except Exception as e:
-        app.logger.error(f'Login error: {e}')
-        return jsonify({'error': 'Login error', 'details': str(e)}), 500
+        # Rate limiting check
+        client_ip = request.remote_addr
+        current_time = time.monotonic()
+        
+        # Check if too many attempts
+        if login_blocked(client_ip, current_time):
+            flash('Too many login attempts. Please try again later.', 'error')
+            return render_template('login.html')
+        
+        # Verify credentials
+        if check_credentials(username, password):
+            # Clear login attempts on successful login
+            clear_login_attempts(client_ip)
+            
+            session.permanent = True
+            session['authenticated'] = True
+            session['username'] = username
+            session['login_time'] = datetime.utcnow().isoformat()  # Shown on the dashboard
+            session['session_id'] = secrets.token_hex(16)
+            session['ip_address'] = client_ip
+            
+            flash('Welcome to Avencion Data Center!', 'success')
+            return redirect(url_for('index'))
+        else:
+            # Record failed attempt
+            record_failed_login(client_ip, current_time)
+            flash('Invalid credentials. Please try again.', 'error')
+    
+    return render_template('login.html')
 
 @app.route('/logout')
 def logout():
+    session.clear()
+    flash('You have been logged out successfully.', 'success')
+    return redirect(url_for('login'))
+
+# The landing page shows PROJECTS_PAGE_SIZE project cards at a time, newest
+# first; older pages are reached through a cursor naming the last card shown.
+# The first page is kept in Redis for a short while, and views that change a
+# project or its cohort count delete the key
+PROJECTS_PAGE_SIZE = 50
+PROJECTS_CACHE_KEY = 'projects:index'
+PROJECTS_CACHE_TTL = 60
+
+def parse_project_cursor(cursor):
+    """The (created_at, id) a page cursor points at, or None if it is invalid"""
+    try:
+        created_at, project_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(project_id)
+    except (AttributeError, ValueError):
+        return None
+
+def query_project_page(cursor=None):
+    """One page of project card fields and the cursor of the page after it"""
+    cohort_count = db.select(db.func.count(Cohort.id)).where(Cohort.project_id == Project.id).scalar_subquery()
+    query = (
+        db.select(Project.id, Project.name, Project.description, Project.project_type,
+                  cohort_count.label('cohort_count'), Project.created_at)
+        .order_by(Project.created_at.desc(), Project.id.desc())
+        .limit(PROJECTS_PAGE_SIZE + 1)
+    )
+    if cursor is not None:
+        created_at, project_id = cursor
+        query = query.where(db.or_(
+            Project.created_at < created_at,
+            db.and_(Project.created_at == created_at, Project.id < project_id),
+        ))
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if len(rows) > PROJECTS_PAGE_SIZE:
+        rows = rows[:PROJECTS_PAGE_SIZE]
+        next_cursor = f'{rows[-1].created_at.isoformat()}_{rows[-1].id}'
+    projects = [
+        {'id': row.id, 'name': row.name, 'description': row.description,
+         'project_type': row.project_type, 'cohort_count': row.cohort_count}
+        for row in rows
+    ]
+    return projects, next_cursor
+
+def get_projects_cached():
+    """The first page of projects from the Redis cache, querying it on a miss"""
+    if redis_client is None:
+        return query_project_page()
     try:
-        session.clear()
-        flash('You have been logged out successfully.', 'success')
-        return redirect(url_for('login'))
+        cached = redis_client.get(PROJECTS_CACHE_KEY)
     except Exception as e:
-        app.logger.error(f'Logout error: {e}')
-        return jsonify({'error': 'Logout error', 'details': str(e)}), 500
+        app.logger.warning('Project cache read error: %s', e)
+        return query_project_page()
+    if cached is not None:
+        page = orjson.loads(cached)
+        return page['projects'], page['next_cursor']
+    projects, next_cursor = query_project_page()
+    try:
+        redis_client.setex(PROJECTS_CACHE_KEY, PROJECTS_CACHE_TTL,
+                           orjson.dumps({'projects': projects, 'next_cursor': next_cursor}))
+    except Exception as e:
+        app.logger.warning('Project cache write error: %s', e)
+    return projects, next_cursor
+
+def invalidate_projects_cache():
+    """Make the next landing page view query the projects again"""
+    if redis_client is not None:
+        try:
+            redis_client.delete(PROJECTS_CACHE_KEY)
+        except Exception as e:
+            app.logger.warning('Project cache delete error: %s', e)
 
 # Main routes
 @app.route('/')
 @login_required
 def index():
-    try:
-        with app.app_context():
-            # Initialize database tables if needed
-            init_database_tables()
-            
-            # Use eager loading to prevent lazy loading issues
-            projects = Project.query.options(db.joinedload(Project.cohorts)).order_by(Project.created_at.desc()).all()
-        return render_template('index.html', projects=projects)
-    except Exception as e:
-        app.logger.error(f'Index error: {e}')
-        return jsonify({'error': 'Index error', 'details': str(e)}), 500
+    cursor = parse_project_cursor(request.args.get('cursor'))
+    if cursor is None:
+        projects, next_cursor = get_projects_cached()
+    else:
+        projects, next_cursor = query_project_page(cursor)
+    return render_template('index.html', projects=projects, next_cursor=next_cursor,
+                           paged=cursor is not None)
 
 @app.route('/project/new', methods=['GET', 'POST'])
 @login_required
 def new_project():
-    try:
-        if request.method == 'POST':
-            name = request.form['name']
-            description = request.form['description']
-            project_type = request.form['project_type']
-            created_by = request.form.get('created_by', 'Avencion')
-            
-            with app.app_context():
-                # Initialize database tables if needed
-                init_database_tables()
-                
-                project = Project(name=name, description=description, project_type=project_type, created_by=created_by)
-                db.session.add(project)
-                db.session.commit()
-            
-            flash('Project created successfully!', 'success')
-            return redirect(url_for('index'))
+    if request.method == 'POST':
+        name = request.form['name']
+        description = request.form['description']
+        project_type = request.form['project_type']
+        created_by = request.form.get('created_by', 'Avencion')
         
-        return render_template('new_project.html')
-    except Exception as e:
-        app.logger.error(f'New project error: {e}')
-        return jsonify({'error': 'New project error', 'details': str(e)}), 500
+        project = Project(name=name, description=description, project_type=project_type, created_by=created_by)
+        db.session.add(project)
+        db.session.commit()
+        invalidate_projects_cache()
+        
+        flash('Project created successfully!', 'success')
+        return redirect(url_for('index'))
+    
+    return render_template('new_project.html')
 
 @app.route('/project/<int:project_id>')
 @login_required
 def project_detail(project_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # Use eager loading to prevent lazy loading issues
-            project = Project.query.options(db.joinedload(Project.cohorts)).get_or_404(project_id)
-        return render_template('project_detail.html', project=project)
-    except Exception as e:
-        app.logger.error(f'Project detail error: {e}')
-        return jsonify({'error': 'Project detail error', 'details': str(e)}), 500
+    # Load the cohorts in one IN query rather than repeating the
+    # project's columns on every joined cohort row
+    project = db.one_or_404(
+        db.select(Project).where(Project.id == project_id).options(selectinload(Project.cohorts))
+    )
+    return render_template('project_detail.html', project=project)
 
 @app.route('/cohort/new/<int:project_id>', methods=['GET', 'POST'])
 @login_required
 def new_cohort(project_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # Use eager loading to prevent lazy loading issues
-            project = Project.query.options(db.joinedload(Project.cohorts)).get_or_404(project_id)
+    if request.method == 'POST':
+        name = request.form['name']
+        description = request.form['description']
+        created_by = request.form.get('created_by', 'Avencion')
         
-        if request.method == 'POST':
-            name = request.form['name']
-            description = request.form['description']
-            created_by = request.form.get('created_by', 'Avencion')
-            
-            with app.app_context():
-                cohort = Cohort(name=name, description=description, project_id=project_id, created_by=created_by)
-                db.session.add(cohort)
-                db.session.commit()
-            
-            flash('Cohort created successfully!', 'success')
-            return redirect(url_for('project_detail', project_id=project_id))
+        # Select the new row's values from the project itself, so the
+        # insert checks that the project exists without a separate load
+        result = db.session.execute(insert(Cohort).from_select(
+            ['name', 'description', 'project_id', 'created_by'],
+            db.select(literal(name), literal(description), Project.id, literal(created_by))
+            .where(Project.id == project_id)
+        ))
+        if result.rowcount == 0:
+            abort(404)
+        db.session.commit()
+        invalidate_projects_cache()
         
-        return render_template('new_cohort.html', project=project)
-    except Exception as e:
-        app.logger.error(f'New cohort error: {e}')
-        return jsonify({'error': 'New cohort error', 'details': str(e)}), 500
+        flash('Cohort created successfully!', 'success')
+        return redirect(url_for('project_detail', project_id=project_id))
+    
+    # The form only shows the project itself, not its cohorts
+    project = db.get_or_404(Project, project_id)
+    return render_template('new_cohort.html', project=project)
 
 @app.route('/cohort/<int:cohort_id>')
 @login_required
 def cohort_detail(cohort_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # Use eager loading to prevent lazy loading issues
-            cohort = Cohort.query.options(db.joinedload(Cohort.project)).get_or_404(cohort_id)
-        return render_template('cohort_detail.html', cohort=cohort)
-    except Exception as e:
-        app.logger.error(f'Cohort detail error: {e}')
-        return jsonify({'error': 'Cohort detail error', 'details': str(e)}), 500
+    # Use eager loading to prevent lazy loading issues
+    cohort = Cohort.query.options(db.joinedload(Cohort.project)).get_or_404(cohort_id)
+    return render_template('cohort_detail.html', cohort=cohort)
 
 # Edit routes
 @app.route('/project/<int:project_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_project(project_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            project = Project.query.get_or_404(project_id)
-            
-            if request.method == 'POST':
-                project.name = request.form['name']
-                project.project_type = request.form['project_type']
-                project.description = request.form.get('description', '')
-                
-                db.session.commit()
-                flash('Project updated successfully!', 'success')
-                return redirect(url_for('project_detail', project_id=project.id))
-            
-        return render_template('edit_project.html', project=project)
-    except Exception as e:
-        app.logger.error(f'Edit project error: {e}')
-        return jsonify({'error': 'Edit project error', 'details': str(e)}), 500
+    if request.method == 'POST':
+        # Update in place rather than loading the row first; updated_at
+        # is still set by the column's onupdate
+        result = db.session.execute(
+            update(Project).where(Project.id == project_id).values(
+                name=request.form['name'],
+                project_type=request.form['project_type'],
+                description=request.form.get('description', ''),
+            )
+        )
+        if result.rowcount == 0:
+            abort(404)
+        db.session.commit()
+        invalidate_projects_cache()
+        flash('Project updated successfully!', 'success')
+        return redirect(url_for('project_detail', project_id=project_id))
+    
+    project = db.get_or_404(Project, project_id)
+    return render_template('edit_project.html', project=project)
 
 @app.route('/cohort/<int:cohort_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_cohort(cohort_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            cohort = Cohort.query.get_or_404(cohort_id)
-            
-            if request.method == 'POST':
-                cohort.name = request.form['name']
-                cohort.description = request.form.get('description', '')
-                
-                db.session.commit()
-                flash('Cohort updated successfully!', 'success')
-                return redirect(url_for('cohort_detail', cohort_id=cohort.id))
-            
-        return render_template('edit_cohort.html', cohort=cohort)
-    except Exception as e:
-        app.logger.error(f'Edit cohort error: {e}')
-        return jsonify({'error': 'Edit cohort error', 'details': str(e)}), 500
+    if request.method == 'POST':
+        result = db.session.execute(
+            update(Cohort).where(Cohort.id == cohort_id).values(
+                name=request.form['name'],
+                description=request.form.get('description', ''),
+            )
+        )
+        if result.rowcount == 0:
+            abort(404)
+        db.session.commit()
+        flash('Cohort updated successfully!', 'success')
+        return redirect(url_for('cohort_detail', cohort_id=cohort_id))
+    
+    cohort = db.get_or_404(Cohort, cohort_id)
+    return render_template('edit_cohort.html', cohort=cohort)
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_spreadsheet(spreadsheet_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # For simplified version, just redirect to detail page
-            flash('Edit functionality not available in simplified version', 'info')
-            return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
-    except Exception as e:
-        app.logger.error(f'Edit spreadsheet error: {e}')
-        return jsonify({'error': 'Edit spreadsheet error', 'details': str(e)}), 500
+    # For simplified version, just redirect to detail page
+    flash('Edit functionality not available in simplified version', 'info')
+    return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/edit-online')
 @login_required
 def edit_spreadsheet_online(spreadsheet_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # For simplified version, just redirect to detail page
-            flash('Online editing not available in simplified version', 'info')
-            return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
-    except Exception as e:
-        app.logger.error(f'Edit spreadsheet online error: {e}')
-        return jsonify({'error': 'Edit spreadsheet online error', 'details': str(e)}), 500
+    # For simplified version, just redirect to detail page
+    flash('Online editing not available in simplified version', 'info')
+    return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
 
 # Database routes (simplified for Vercel)
 @app.route('/database/new/<int:project_id>', methods=['GET', 'POST'])
 @login_required
 def new_database(project_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            project = Project.query.get_or_404(project_id)
-        
-        if request.method == 'POST':
-            flash('Database creation not available in simplified version', 'info')
-            return redirect(url_for('project_detail', project_id=project_id))
-        
-        return render_template('new_database.html', project=project)
-    except Exception as e:
-        app.logger.error(f'New database error: {e}')
-        return jsonify({'error': 'New database error', 'details': str(e)}), 500
+    project = db.get_or_404(Project, project_id)
+    
+    if request.method == 'POST':
+        flash('Database creation not available in simplified version', 'info')
+        return redirect(url_for('project_detail', project_id=project_id))
+    
+    return render_template('new_database.html', project=project)
 
 @app.route('/database/<int:database_id>/tables')
 @login_required
 def database_tables(database_id):
-    try:
-        # For simplified version, return empty tables list
-        return jsonify({'tables': []})
-    except Exception as e:
-        app.logger.error(f'Database tables error: {e}')
-        return jsonify({'error': 'Database tables error', 'details': str(e)}), 500
+    # For simplified version, return empty tables list
+    return jsonify({'tables': []})
 
 @app.route('/database/<int:database_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_database(database_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # For simplified version, just redirect to project detail
-            flash('Database editing not available in simplified version', 'info')
-            return redirect(url_for('project_detail', project_id=1))  # Fallback
-    except Exception as e:
-        app.logger.error(f'Edit database error: {e}')
-        return jsonify({'error': 'Edit database error', 'details': str(e)}), 500
+    # For simplified version, just redirect to project detail
+    flash('Database editing not available in simplified version', 'info')
+    return redirect(url_for('project_detail', project_id=1))  # Fallback
 
 # Spreadsheet routes (simplified for Vercel)
 @app.route('/spreadsheet/create/<int:cohort_id>', methods=['GET', 'POST'])
 @login_required
 def create_spreadsheet(cohort_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # For simplified version, just redirect to cohort detail
-            flash('Spreadsheet creation not available in simplified version', 'info')
-            return redirect(url_for('cohort_detail', cohort_id=cohort_id))
-    except Exception as e:
-        app.logger.error(f'Create spreadsheet error: {e}')
-        return jsonify({'error': 'Create spreadsheet error', 'details': str(e)}), 500
+    # For simplified version, just redirect to cohort detail
+    flash('Spreadsheet creation not available in simplified version', 'info')
+    return redirect(url_for('cohort_detail', cohort_id=cohort_id))
 
 @app.route('/spreadsheet/upload/<int:cohort_id>', methods=['GET', 'POST'])
 @login_required
 def upload_spreadsheet(cohort_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # For simplified version, just redirect to cohort detail
-            flash('File upload not available in simplified version', 'info')
-            return redirect(url_for('cohort_detail', cohort_id=cohort_id))
-    except Exception as e:
-        app.logger.error(f'Upload spreadsheet error: {e}')
-        return jsonify({'error': 'Upload spreadsheet error', 'details': str(e)}), 500
+    # For simplified version, just redirect to cohort detail
+    flash('File upload not available in simplified version', 'info')
+    return redirect(url_for('cohort_detail', cohort_id=cohort_id))
 
 @app.route('/spreadsheet/<int:spreadsheet_id>')
 @login_required
 def spreadsheet_detail(spreadsheet_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # For simplified version, just redirect to cohort detail
-            flash('Spreadsheet details not available in simplified version', 'info')
-            return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
-    except Exception as e:
-        app.logger.error(f'Spreadsheet detail error: {e}')
-        return jsonify({'error': 'Spreadsheet detail error', 'details': str(e)}), 500
+    # For simplified version, just redirect to cohort detail
+    flash('Spreadsheet details not available in simplified version', 'info')
+    return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/view')
 @login_required
 def view_spreadsheet(spreadsheet_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # For simplified version, just redirect to cohort detail
-            flash('Spreadsheet viewing not available in simplified version', 'info')
-            return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
-    except Exception as e:
-        app.logger.error(f'View spreadsheet error: {e}')
-        return jsonify({'error': 'View spreadsheet error', 'details': str(e)}), 500
+    # For simplified version, just redirect to cohort detail
+    flash('Spreadsheet viewing not available in simplified version', 'info')
+    return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/download')
 @login_required
 def download_spreadsheet(spreadsheet_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # For simplified version, just redirect to cohort detail
-            flash('File download not available in simplified version', 'info')
-            return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
-    except Exception as e:
-        app.logger.error(f'Download spreadsheet error: {e}')
-        return jsonify({'error': 'Download spreadsheet error', 'details': str(e)}), 500
+    # For simplified version, just redirect to cohort detail
+    flash('File download not available in simplified version', 'info')
+    return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
 
 @app.route('/spreadsheet/<int:spreadsheet_id>/recreate', methods=['POST'])
 @login_required
 def recreate_spreadsheet(spreadsheet_id):
-    try:
-        with app.app_context():
-            # Ensure tables exist before querying
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # For simplified version, just redirect to cohort detail
-            flash('Spreadsheet recreation not available in simplified version', 'info')
-            return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
-    except Exception as e:
-        app.logger.error(f'Recreate spreadsheet error: {e}')
-        return jsonify({'error': 'Recreate spreadsheet error', 'details': str(e)}), 500
+    # For simplified version, just redirect to cohort detail
+    flash('Spreadsheet recreation not available in simplified version', 'info')
+    return redirect(url_for('cohort_detail', cohort_id=1))  # Fallback
 
 @app.route('/help')
 @login_required
 def help_page():
-    try:
-        return render_template('help.html')
-    except Exception as e:
-        app.logger.error(f'Help error: {e}')
-        return jsonify({'error': 'Help error', 'details': str(e)}), 500
+    return render_template('help.html')
+
+# The status routes report the time to the second, so build that string once
+# per second rather than on every probe
+last_timestamp = (0, '')  # (whole epoch second, its ISO string)
+
+def utc_timestamp():
+    """The current UTC time as an ISO string with its offset, to whole seconds"""
+    global last_timestamp
+    now = int(time.time())
+    if last_timestamp[0] != now:
+        last_timestamp = (now, datetime.fromtimestamp(now, timezone.utc).isoformat())
+    return last_timestamp[1]
 
 # Database initialization route
 @app.route('/init-db')
 def init_database():
+    global table_names
     try:
         with app.app_context():
             db.create_all()
+            table_names = None
             return jsonify({
                 'status': 'success',
                 'message': 'Database tables created successfully',
-                'timestamp': datetime.utcnow().isoformat()
+                'timestamp': utc_timestamp()
             })
     except Exception as e:
-        app.logger.error(f'Database initialization error: {e}')
+        app.logger.error('Database initialization error: %s', e)
         return jsonify({
             'status': 'error',
             'message': 'Failed to create database tables',
             'error': str(e),
-            'timestamp': datetime.utcnow().isoformat()
+            'timestamp': utc_timestamp()
         }), 500
 
+# /health trusts a successful ping for HEALTH_PING_INTERVAL seconds, so
+# frequent probes reach the database at most that often. /test-db always pings
+# but reuses the table list, which changes only when the tables are created
+DB_PING = text('SELECT 1')
+HEALTH_PING_INTERVAL = 10
+last_health_ping = 0.0  # time.monotonic() of the last successful ping
+table_names = None
+
+def ping_database():
+    """Run SELECT 1 on a pooled connection"""
+    with db.engine.connect() as connection:
+        connection.execute(DB_PING)
+
+def get_table_names():
+    """The database's table names, inspected once per process"""
+    global table_names
+    if table_names is None:
+        table_names = db.inspect(db.engine).get_table_names()
+    return table_names
+
 # Database connection test route
 @app.route('/test-db')
 def test_database():
     try:
-        with app.app_context():
-            # Test database connection
-            db.engine.execute('SELECT 1')
-            
-            # Check if tables exist
-            inspector = db.inspect(db.engine)
-            tables = inspector.get_table_names()
-            
-            # Try to query projects
-            project_count = Project.query.count()
-            
-            return jsonify({
-                'status': 'success',
-                'message': 'Database connection successful',
-                'database_url': app.config['SQLALCHEMY_DATABASE_URI'].replace('://', '://***:***@') if '@' in app.config['SQLALCHEMY_DATABASE_URI'] else app.config['SQLALCHEMY_DATABASE_URI'],
-                'tables': tables,
-                'project_count': project_count,
-                'timestamp': datetime.utcnow().isoformat()
-            })
+        # Test database connection
+        ping_database()
+        
+        # Check if tables exist
+        tables = get_table_names()
+        
+        # Try to query projects
+        project_count = Project.query.count()
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Database connection successful',
+            'database_url': MASKED_DATABASE_URI,
+            'tables': tables,
+            'project_count': project_count,
+            'timestamp': utc_timestamp()
+        })
     except Exception as e:
-        app.logger.error(f'Database test error: {e}')
+        app.logger.error('Database test error: %s', e)
         return jsonify({
             'status': 'error',
             'message': 'Database connection failed',
             'error': str(e),
-            'database_url': app.config['SQLALCHEMY_DATABASE_URI'].replace('://', '://***:***@') if '@' in app.config['SQLALCHEMY_DATABASE_URI'] else app.config['SQLALCHEMY_DATABASE_URI'],
-            'timestamp': datetime.utcnow().isoformat()
+            'database_url': MASKED_DATABASE_URI,
+            'timestamp': utc_timestamp()
         }), 500
 
 # Health check for Vercel
-@app.route('/health')
-def health_check():
+def health_status():
+    """The health probe's status line and body, pinging the database if due"""
+    global last_health_ping
     try:
-        # Test database connection and ensure tables exist
-        with app.app_context():
-            # Try to create tables if they don't exist
-            try:
-                db.create_all()
-            except:
-                pass
-            
-            # Test a simple query
-            db.engine.execute('SELECT 1')
-        return jsonify({
+        now = time.monotonic()
+        if now - last_health_ping >= HEALTH_PING_INTERVAL:
+            with app.app_context():
+                ping_database()
+            last_health_ping = now
+        return '200 OK', {
             'status': 'healthy', 
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': utc_timestamp(),
             'database': 'connected'
-        })
+        }
     except Exception as e:
-        app.logger.error(f'Health check error: {e}')
-        return jsonify({
+        app.logger.error('Health check error: %s', e)
+        return '500 INTERNAL SERVER ERROR', {
             'status': 'unhealthy', 
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': utc_timestamp(),
             'error': str(e)
-        }), 500
-
-# Simple test route without database
-@app.route('/test')
-def test():
-    return jsonify({
-        'status': 'ok',
-        'message': 'Flask app is running',
-        'timestamp': datetime.utcnow().isoformat()
-    })
-
-# Favicon route to prevent 404 errors
-@app.route('/favicon.ico')
-@app.route('/favicon.png')
-def favicon():
-    return '', 204  # No content response
-
-# For Vercel deployment
-app.debug = False
+        }
+
+# The favicon, /test and /health need no session, so answer them before Flask
+# opens one (a Redis read with server-side sessions) and runs the request
+# hooks. They still carry the security headers
+FAVICON_PATHS = frozenset({'/favicon.ico', '/favicon.png'})
+QUICK_PATHS = FAVICON_PATHS | {'/test', '/health'}
+QUICK_RESPONSE_HEADERS = list(SECURITY_HEADERS.items())
+
+class QuickResponses:
+    """WSGI middleware serving the favicon, /test and /health paths ahead of Flask"""
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO')
+        method = environ.get('REQUEST_METHOD')
+        if method not in ('GET', 'HEAD') or path not in QUICK_PATHS:
+            return self.wsgi_app(environ, start_response)
+        if path in FAVICON_PATHS:
+            start_response('204 NO CONTENT', QUICK_RESPONSE_HEADERS)
+            return []
+        if path == '/health':
+            status, payload = health_status()
+        else:
+            # Simple test route without database
+            status, payload = '200 OK', {
+                'status': 'ok',
+                'message': 'Flask app is running',
+                'timestamp': utc_timestamp()
+            }
+        body = orjson.dumps(payload)
+        start_response(status, QUICK_RESPONSE_HEADERS + [
+            ('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return [] if method == 'HEAD' else [body]
+
+app.wsgi_app = QuickResponses(app.wsgi_app)
 
 if __name__ == '__main__':
     # Ensure tables are created for local development
@@ -0,0 +1,93 @@
+"""
+Login checks and JSON handling shared by the Avencion app modules
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+
+import orjson
+from dotenv import load_dotenv
+from flask.json.provider import JSONProvider
+
+# The apps import this module before loading .env themselves
+load_dotenv()
+
+# Authentication configuration
+AVENCION_USERNAME = "Avencion"
+# Only an scrypt key of the password is kept
+AVENCION_PASSWORD_SALT = bytes.fromhex('15935620be581932112f813f0a3b2607')
+AVENCION_PASSWORD_KEY = bytes.fromhex(
+    'ddec8016feb572e1f91e8d2744e3ab8f92cb071567e47c19f9e4fef0d28f3c0f'
+    '1c8f7fb32464b9506905b13cba2fdf5454cb528b446a75a1f27e641e337b1922'
+)
+SCRYPT_PARAMS = {'n': 2 ** 14, 'r': 8, 'p': 1}
+
+def parse_password_scrypt(value):
+    """Split a "<salt hex>:<key hex>" pair into the salt and 64-byte key it names"""
+    try:
+        salt_hex, key_hex = value.split(':')
+        salt, key = bytes.fromhex(salt_hex), bytes.fromhex(key_hex)
+    except ValueError:
+        salt = key = b''
+    if not salt or len(key) != 64:
+        raise RuntimeError(
+            "AVENCION_PASSWORD_SCRYPT must be '<salt hex>:<key hex>' with a 64-byte "
+            "scrypt key; see env_example.txt for how to generate it"
+        )
+    return salt, key
+
+# A deployment can replace the built-in password with its own pair, derived
+# with SCRYPT_PARAMS; a malformed value stops the app rather than leaving the
+# built-in password in place
+if os.environ.get('AVENCION_PASSWORD_SCRYPT'):
+    AVENCION_PASSWORD_SALT, AVENCION_PASSWORD_KEY = parse_password_scrypt(os.environ['AVENCION_PASSWORD_SCRYPT'])
+AVENCION_USERNAME_BYTES = AVENCION_USERNAME.encode()
+
+# Keyed BLAKE2b of the password once it has passed the scrypt check, so repeat
+# logins skip the key derivation; wrong passwords always pay for it. The key
+# is random per process, so the remembered digest is useless outside it
+VERIFIED_DIGEST_KEY = secrets.token_bytes(32)
+verified_password_digest = None
+
+def check_password(password):
+    """Check a password against the scrypt key, remembering the one that matched"""
+    global verified_password_digest
+    password_bytes = (password or '').encode()
+    digest = hashlib.blake2b(password_bytes, key=VERIFIED_DIGEST_KEY, digest_size=32).digest()
+    if verified_password_digest is not None and hmac.compare_digest(digest, verified_password_digest):
+        return True
+    key = hashlib.scrypt(password_bytes, salt=AVENCION_PASSWORD_SALT, **SCRYPT_PARAMS)
+    if hmac.compare_digest(key, AVENCION_PASSWORD_KEY):
+        verified_password_digest = digest
+        return True
+    return False
+
+def check_credentials(username, password):
+    """Check both credentials in constant time, always checking the password"""
+    username_ok = hmac.compare_digest((username or '').encode(), AVENCION_USERNAME_BYTES)
+    return username_ok & check_password(password)
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, used by jsonify"""
+    @staticmethod
+    def dumps_bytes(obj):
+        """Serialize obj to UTF-8 encoded JSON; apps override this for extra types"""
+        return orjson.dumps(obj)
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj).decode()
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of decoding
+        # them to str for Flask to encode again
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype='application/json')
+
+    def loads(self, s, **kwargs):
+        # Session cookies are decoded with an object_hook, which orjson lacks
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
@@ -26,22 +26,27 @@ def check_environment():
         'VERCEL': 'Vercel deployment flag'
     }
     
-    print("\n📋 Environment Variables:")
+    # Read each variable once, after .env is loaded, and reuse the values below
+    values = {var: os.environ.get(var) for var in env_vars}
+    
+    # Build the listing first and write it in one call
+    lines = ["\n📋 Environment Variables:"]
     for var, description in env_vars.items():
-        value = os.environ.get(var)
+        value = values[var]
         if value:
             if 'password' in var.lower() or 'secret' in var.lower():
                 # Mask sensitive values
                 masked_value = value[:10] + '...' if len(value) > 10 else '***'
-                print(f"✅ {var}: {masked_value} ({description})")
+                lines.append(f"✅ {var}: {masked_value} ({description})")
             else:
-                print(f"✅ {var}: {value} ({description})")
+                lines.append(f"✅ {var}: {value} ({description})")
         else:
-            print(f"❌ {var}: Not set ({description})")
+            lines.append(f"❌ {var}: Not set ({description})")
+    print("\n".join(lines))
     
     # Check database configuration
     print("\n🗄️ Database Configuration:")
-    database_url = os.environ.get('DATABASE_URL')
+    database_url = values['DATABASE_URL']
     
     if database_url:
         if 'postgresql://' in database_url:
@@ -60,7 +65,7 @@ def check_environment():
     
     # Check if running on Vercel
     print("\n🌐 Deployment Environment:")
-    if os.environ.get('VERCEL'):
+    if values['VERCEL']:
         print("✅ Running on Vercel")
     else:
         print("✅ Running locally")
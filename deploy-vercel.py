@@ -5,20 +5,106 @@ Vercel Deployment Helper Script for Avencion Data Center
 
 import os
 import sys
-import subprocess
 import json
-from pathlib import Path
+import shutil
+import hashlib
+import subprocess
+from functools import lru_cache, wraps
+
+# Checks that passed are remembered here, keyed on their inputs; run with --force to ignore it
+DEPLOY_CACHE_FILE = '.deploy-cache.json'
+FORCE_CHECKS = '--force' in sys.argv
+
+REQUIRED_FILES = ('app_simple_working.py', 'api/index.py', 'vercel.json', 'requirements.txt')
+REQUIRED_VARS = ('SECRET_KEY', 'DATABASE_URL')
+
+@lru_cache(maxsize=None)
+def directory_entries(directory):
+    """Names in directory, listed once per run; the script creates none of the files it checks"""
+    try:
+        with os.scandir(directory) as entries:
+            return frozenset(entry.name for entry in entries)
+    except (FileNotFoundError, NotADirectoryError):
+        return frozenset()
+
+def path_exists(path):
+    """Whether path exists, answered from one listing of its directory"""
+    directory, name = os.path.split(path)
+    return name in directory_entries(directory or '.')
+
+@lru_cache(maxsize=None)
+def vercel_bin():
+    """Absolute path of the Vercel CLI, resolved once per run, or None if it is not on PATH"""
+    return shutil.which('vercel')
+
+@lru_cache(maxsize=None)
+def file_stat(path):
+    """stat of path taken once per run, or None if it cannot be read; checks share the result"""
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def file_signature(paths, *extra):
+    """Digest of each path's modification time and size, plus any extra values"""
+    state = []
+    for path in paths:
+        stat = file_stat(path)
+        if stat is None:
+            state.append([path, None, None])
+        else:
+            state.append([path, stat.st_mtime_ns, stat.st_size])
+    state.extend(extra)
+    return hashlib.sha256(json.dumps(state).encode()).hexdigest()
 
+@lru_cache(maxsize=None)
+def load_deploy_cache():
+    """Signatures of the checks that passed on earlier runs"""
+    try:
+        with open(DEPLOY_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_deploy_cache():
+    try:
+        with open(DEPLOY_CACHE_FILE, 'w') as f:
+            json.dump(load_deploy_cache(), f)
+    except OSError:
+        pass
+
+def memoized_check(description, signature):
+    """Skip a check that passed before while signature() is unchanged"""
+    def decorator(check):
+        @wraps(check)
+        def decorated_function():
+            cache = load_deploy_cache()
+            key = signature()
+            if not FORCE_CHECKS and cache.get(check.__name__) == key:
+                print(f"✅ {description} unchanged since the last successful check (use --force to re-run)")
+                return True
+            
+            result = check()
+            # Only passing results are kept, so a failing check is always run again
+            if result:
+                cache[check.__name__] = key
+            else:
+                cache.pop(check.__name__, None)
+            save_deploy_cache()
+            return result
+        return decorated_function
+    return decorator
+
+@memoized_check('Prerequisites', lambda: file_signature((*REQUIRED_FILES, vercel_bin() or 'vercel')))
 def check_prerequisites():
     """Check if all prerequisites are met"""
     print("🔍 Checking prerequisites...")
     
     # Check if we're in the right directory
-    required_files = ['app_simple_working.py', 'api/index.py', 'vercel.json', 'requirements.txt']
     missing_files = []
     
-    for file in required_files:
-        if not Path(file).exists():
+    for file in REQUIRED_FILES:
+        if not path_exists(file):
             missing_files.append(file)
     
     if missing_files:
@@ -28,19 +114,13 @@ def check_prerequisites():
     print("✅ All required files found")
     
     # Check if Vercel CLI is installed
-    try:
-        result = subprocess.run(['vercel', '--version'], capture_output=True, text=True)
-        if result.returncode == 0:
-            print(f"✅ Vercel CLI found: {result.stdout.strip()}")
-        else:
-            print("❌ Vercel CLI not found or not working")
-            print("   Install with: npm i -g vercel")
-            return False
-    except FileNotFoundError:
+    if vercel_bin() is None:
         print("❌ Vercel CLI not installed")
         print("   Install with: npm i -g vercel")
         return False
     
+    print(f"✅ Vercel CLI found: {vercel_bin()}")
+    
     return True
 
 def check_environment_variables():
@@ -48,15 +128,14 @@ def check_environment_variables():
     print("\n🔍 Checking environment variables...")
     
     # Check for .env file
-    if Path('.env').exists():
+    if path_exists('.env'):
         print("✅ .env file found")
         return True
     
     # Check for environment variables
-    required_vars = ['SECRET_KEY', 'DATABASE_URL']
     missing_vars = []
     
-    for var in required_vars:
+    for var in REQUIRED_VARS:
         if not os.environ.get(var):
             missing_vars.append(var)
     
@@ -100,18 +179,23 @@ PERMANENT_SESSION_LIFETIME=86400
     print("✅ Created .env.template file")
     print("   Copy this to .env and configure your values")
 
+# The local test imports the app and creates its tables, so it depends on the app modules and the database it points at
+APP_FILES = ('app_simple_working.py', 'api/index.py', '.env')
+
+@memoized_check('Local app test', lambda: file_signature(APP_FILES, os.environ.get('DATABASE_URL')))
 def test_app_locally():
     """Test the app locally"""
     print("\n🧪 Testing app locally...")
     
     try:
         # Test if the app can be imported
-        sys.path.append('.')
-        from app_simple_working import app
+        if os.getcwd() not in sys.path:
+            sys.path.append(os.getcwd())
+        from app_simple_working import app, ensure_tables
         
+        # A no-op if the import already created the tables
         with app.app_context():
-            from app_simple_working import db
-            db.create_all()
+            ensure_tables()
         
         print("✅ App imports successfully")
         print("✅ Database tables can be created")
@@ -126,16 +210,17 @@ def deploy_to_vercel():
     print("\n🚀 Deploying to Vercel...")
     
     try:
-        # Run vercel command
-        result = subprocess.run(['vercel', '--prod'], capture_output=True, text=True)
+        # Run vercel command, showing its output as it arrives
+        with subprocess.Popen([vercel_bin() or 'vercel', '--prod'], stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, text=True) as process:
+            for line in process.stdout:
+                print(line, end='')
         
-        if result.returncode == 0:
+        if process.returncode == 0:
             print("✅ Deployment successful!")
-            print(result.stdout)
             return True
         else:
             print("❌ Deployment failed!")
-            print(result.stderr)
             return False
             
     except Exception as e:
@@ -156,7 +241,7 @@ def main():
     check_environment_variables()
     
     # Create env template if needed
-    if not Path('.env').exists():
+    if not path_exists('.env'):
         create_env_template()
     
     # Test app locally
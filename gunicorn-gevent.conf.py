@@ -0,0 +1,33 @@
+# Gunicorn settings for the Docker image, passed with -c; install
+# requirements-gevent.txt to use them. The routes spend their time waiting on
+# PostgreSQL rather than computing, so gevent workers serve many requests each
+# instead of one at a time.
+# Not for app_simple: patching turns its background_executor threads into
+# greenlets, so a workbook parse there would block every request on the worker.
+# Serve app_simple with gunicorn's default workers instead
+from gevent import monkey
+
+# Patch before gunicorn (and, with --preload, the app) import anything else,
+# so sockets, threads and locks all cooperate with the gevent hub
+monkey.patch_all()
+
+import multiprocessing
+import os
+
+from psycogreen.gevent import patch_psycopg
+
+# psycopg2 talks to libpq in C, which monkey patching cannot reach; this makes
+# its queries yield to other greenlets while waiting on the server
+patch_psycopg()
+
+worker_class = 'gevent'
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_connections = 1000
+
+# Each worker has its own database pool. Split a connection budget, by default
+# kept under PostgreSQL's max_connections=100, across them. The served app
+# (app.py, as do app_simple and app_simple_working) sizes its PostgreSQL pool
+# from these when the master imports it
+per_worker = max(2, int(os.environ.get('DB_MAX_CONNECTIONS', '90')) // workers)
+os.environ.setdefault('DB_POOL_SIZE', str(per_worker // 2))
+os.environ.setdefault('DB_MAX_OVERFLOW', str(per_worker - per_worker // 2))
@@ -5,9 +5,17 @@ Test script for Vercel deployment verification
 
 import os
 import sys
-import requests
-import json
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def deployment_session():
+    """One session for all deployment checks, so connections to the host are kept alive and reused"""
+    # requests is only needed once a deployment URL is given, so it is imported here
+    import requests
+    session = requests.Session()
+    session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=4))
+    return session
 
 def test_local_app():
     """Test the app locally"""
@@ -15,13 +23,13 @@ def test_local_app():
     
     try:
         # Import the app
-        sys.path.append('.')
-        from app_simple_working import app
+        if os.getcwd() not in sys.path:
+            sys.path.append(os.getcwd())
+        from app_simple_working import app, ensure_tables
         
-        # Test database connection
+        # Test database connection; a no-op if the import already created the tables
         with app.app_context():
-            from app_simple_working import db
-            db.create_all()
+            ensure_tables()
             print("✅ Database tables created successfully")
         
         # Test basic functionality
@@ -59,35 +67,41 @@ def test_local_app():
 def test_vercel_deployment(url):
     """Test the deployed app on Vercel"""
     print(f"\n🌐 Testing Vercel deployment at: {url}")
+    import requests
+    session = deployment_session()
     
     try:
-        # Test health endpoint
-        response = requests.get(f"{url}/health", timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ Health check: {data.get('status', 'unknown')}")
-        else:
-            print(f"❌ Health check failed: {response.status_code}")
-            return False
-        
-        # Test database endpoint
-        response = requests.get(f"{url}/test-db", timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ Database test: {data.get('status', 'unknown')}")
-            if 'project_count' in data:
-                print(f"   Projects in database: {data['project_count']}")
-        else:
-            print(f"❌ Database test failed: {response.status_code}")
-            return False
-        
-        # Test main page (should redirect to login)
-        response = requests.get(url, timeout=10)
-        if response.status_code in [200, 302]:
-            print("✅ Main page accessible")
-        else:
-            print(f"❌ Main page failed: {response.status_code}")
-            return False
+        # Fetch the health, database and main pages at once; results are checked in order below
+        paths = ['/health', '/test-db', '']
+        with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            health, database, main_page = executor.map(
+                lambda path: session.get(f"{url}{path}", timeout=10), paths
+            )
+            
+            # Test health endpoint
+            if health.status_code == 200:
+                data = health.json()
+                print(f"✅ Health check: {data.get('status', 'unknown')}")
+            else:
+                print(f"❌ Health check failed: {health.status_code}")
+                return False
+            
+            # Test database endpoint
+            if database.status_code == 200:
+                data = database.json()
+                print(f"✅ Database test: {data.get('status', 'unknown')}")
+                if 'project_count' in data:
+                    print(f"   Projects in database: {data['project_count']}")
+            else:
+                print(f"❌ Database test failed: {database.status_code}")
+                return False
+            
+            # Test main page (should redirect to login)
+            if main_page.status_code in [200, 302]:
+                print("✅ Main page accessible")
+            else:
+                print(f"❌ Main page failed: {main_page.status_code}")
+                return False
         
         return True
         
@@ -110,17 +124,20 @@ def check_environment():
         'VERCEL': os.environ.get('VERCEL')
     }
     
+    # Build the listing first and write it in one call
+    lines = []
     for var, value in env_vars.items():
         if value:
             if 'password' in var.lower() or 'secret' in var.lower():
-                print(f"✅ {var}: {'*' * 10}")
+                lines.append(f"✅ {var}: {'*' * 10}")
             else:
-                print(f"✅ {var}: {value}")
+                lines.append(f"✅ {var}: {value}")
         else:
-            print(f"⚠️  {var}: Not set")
+            lines.append(f"⚠️  {var}: Not set")
+    print("\n".join(lines))
     
     # Check if we're in Vercel
-    if os.environ.get('VERCEL'):
+    if env_vars['VERCEL']:
         print("✅ Running in Vercel environment")
     else:
         print("ℹ️  Running in local environment")